@@ -0,0 +1,164 @@
+import email.utils
+import os
+import random
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import telemetry
+
+load_dotenv()
+
+POOL_SIZE = int(os.getenv("API_POOL_SIZE", "8"))
+CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("API_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("API_BACKOFF_MAX", "30"))
+
+# Transient statuses worth another attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_session = None
+_stats = {
+    "requests": 0,
+    "connections": 0,
+    "retries": 0,
+    "errors": 0,
+    "handshake_seconds": 0.0,
+}
+
+def _count(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+
+class _TimedHTTPConnection(HTTPConnection):
+    """HTTP connection that records every new socket it opens"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _count("connections")
+            _count("handshake_seconds", time.perf_counter() - start)
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection that records every new socket and TLS handshake"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _count("connections")
+            _count("handshake_seconds", time.perf_counter() - start)
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedAdapter(HTTPAdapter):
+    """Keep-alive adapter whose pools use the timed connection classes"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    with _lock:
+        if _session is None:
+            adapter = _TimedAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+def retry_after_delay(response):
+    """Seconds to wait according to a Retry-After header, if one was sent"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return min(BACKOFF_MAX, max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return min(BACKOFF_MAX, max(0.0, when.timestamp() - time.time()))
+
+def post(url, **kwargs):
+    """POST through the pooled session, retrying transient failures.
+
+    Connection errors, timeouts and the statuses in RETRY_STATUSES are
+    retried up to MAX_RETRIES times. A Retry-After header takes precedence
+    over the exponential backoff. The last response is returned as-is, so
+    callers still call raise_for_status() themselves.
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    session = get_session()
+
+    for attempt in range(MAX_RETRIES + 1):
+        _count("requests")
+        try:
+            response = session.post(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            _count("errors")
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            _count("errors")
+            if attempt == MAX_RETRIES:
+                return response
+            delay = retry_after_delay(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            response.close()
+
+        _count("retries")
+        time.sleep(delay)
+
+def stats():
+    """Snapshot of the connection counters"""
+    with _lock:
+        snapshot = dict(_stats)
+    requests_made = snapshot["requests"]
+    connections = snapshot["connections"]
+    snapshot["reuse_rate"] = (
+        max(0.0, 1.0 - connections / requests_made) if requests_made else 0.0
+    )
+    snapshot["avg_handshake_ms"] = (
+        1000.0 * snapshot["handshake_seconds"] / connections if connections else 0.0
+    )
+    return snapshot
+
+def reset_stats():
+    """Zero all counters, e.g. between benchmark runs"""
+    with _lock:
+        for key in _stats:
+            _stats[key] = 0.0 if key == "handshake_seconds" else 0
+
+telemetry.register_gauges("api", stats)
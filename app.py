@@ -1,9 +1,25 @@
 from dotenv import load_dotenv
 import numpy as np
 import streamlit as st
-from PIL import Image, ExifTags
 import process
+import api_client
+import backends
+import gallery
+import ingest
+import live
+import observations
+import telemetry
+import video
+import tempfile
+import hashlib
 import os
+import sqlite3
+import time
+import av
+from streamlit_webrtc import WebRtcMode, webrtc_streamer
+from aiortc.contrib.media import MediaPlayer
+
+telemetry.serve()
 
 # Title for the app
 st.title("Lettuce Health Monitoring")
@@ -19,7 +35,7 @@ st.markdown("""
 # Input selection
 st.subheader("Input Options")
 input_option = st.radio("Choose input type", 
-                       ("Upload Image", "Take a Picture"), 
+                       ("Upload Image", "Take a Picture", "Live Camera", "Upload Video"), 
                        key="input_radio")
 
 with st.sidebar:
@@ -42,68 +58,260 @@ with st.sidebar:
     )
     st.session_state['confidence_threshold'] = confidence_threshold
 
-def process_image(image_path):
+    # Small seedlings and weeds vanish when a large photo is shrunk to 640 px
+    tiled = st.checkbox("Tiled Inference (full resolution)", value=False,
+                        help="Analyse the original in overlapping tiles; slower but finds small plants")
+
+    plot = st.text_input("Plot / Bed", value=observations.DEFAULT_PLOT,
+                         help="Observations are stored and summarized per plot")
+
+    if not telemetry.ENABLED:
+        with st.expander("API Connection Stats"):
+            st.json(api_client.stats())
+
+def get_results(image_key, image, image_bytes):
+    """Fetch detections once per image and keep them in session state"""
+    results_key = (image_key, tiled)
+    if st.session_state.get('results_key') != results_key:
+        with st.spinner("Analyzing image..."), telemetry.span("analysis", tiled=tiled):
+            results = process.fetch_results(image, image_bytes, tiled)
+        if results is None:
+            return None
+        st.session_state['results_key'] = results_key
+        st.session_state['results'] = results
+    return st.session_state['results']
+
+def process_image(image_key, image, image_bytes):
     """Process image with selected visualization mode"""
-    with st.spinner("Analyzing image..."):
-        if visualization_mode == "Segmentation":
-            process.process_static_image_segment(image_path)
+    results = get_results(image_key, image, image_bytes)
+    if results is None:
+        return
+    if visualization_mode == "Segmentation":
+        process.process_static_image_segment(image, image_bytes, results)
+    else:
+        process.process_static_image_box(image, image_bytes, results)
+    record_observation(image_key, image, results)
+
+def record_observation(image_key, image, results):
+    """Persist the analysis once per image and plot, and show the plot's trend"""
+    record_key = (image_key, plot)
+    if st.session_state.get('recorded_key') != record_key:
+        ingested = st.session_state['ingested']
+        try:
+            observations.record(image_key, results, image.size, plot, exif=ingested.exif,
+                                full_size=ingested.full_size)
+            ratios = observations.class_ratio("disease_lettuce", days=30)
+        except sqlite3.Error as e:
+            st.warning(f"Could not save observation: {e}")
+            return
+        st.session_state['recorded_key'] = record_key
+        st.session_state['disease_ratios'] = ratios
+    with st.sidebar.expander("Diseased Lettuce Ratio (30 days)"):
+        st.table({name: f"{ratio:.1%}" for name, ratio in
+                  st.session_state['disease_ratios'].items()})
+
+def load_image(file_buffer):
+    """Decode an upload once per session and reuse it across reruns.
+
+    Only a working copy at preview/model resolution is decoded, upright
+    according to its EXIF orientation, and the preview is encoded once.
+    Reruns recognise the upload by its file id without copying its bytes.
+    """
+    if st.session_state.get('upload_id') != file_buffer.file_id:
+        image_bytes = file_buffer.getvalue()
+        image_key = hashlib.sha256(image_bytes).hexdigest()
+        ingested = ingest.IngestedImage(image_bytes, process.working_max_side())
+        st.session_state['upload_id'] = file_buffer.file_id
+        st.session_state['image_key'] = image_key
+        st.session_state['ingested'] = ingested
+        st.session_state['preview'] = process.display_jpeg(ingested.image)
+    ingested = st.session_state['ingested']
+    return st.session_state['image_key'], ingested.image, ingested.image_bytes
+
+def show_batch(uploaded_images):
+    """Analyse many uploads on the background pool and show them as a gallery"""
+    # Threshold and mode only change the drawing, which happens locally
+    batch_key = (tuple(f.file_id for f in uploaded_images), tiled, plot)
+    if st.session_state.get('batch_key') != batch_key:
+        if 'batch' in st.session_state:
+            st.session_state['batch'].cancel()
+        files = [(f.name, f.getvalue()) for f in uploaded_images]
+        st.session_state['batch_key'] = batch_key
+        st.session_state['batch'] = gallery.Batch(files, tiled, plot)
+    batch = st.session_state['batch']
+    segment = visualization_mode == "Segmentation"
+
+    # Only this fragment reruns while images are being analysed
+    @st.fragment(run_every=None if batch.finished() else 1.0)
+    def batch_gallery():
+        done = batch.done()
+        st.progress(done / len(batch), text=f"Analyzed {done}/{len(batch)} images")
+        totals = {}
+        columns = st.columns(3)
+        for index, (name, result, error) in enumerate(batch.results()):
+            with columns[index % 3]:
+                if error is not None:
+                    st.error(f"{name}: {error}")
+                    continue
+                image, class_counts = gallery.render(result, segment, confidence_threshold)
+                counts = ", ".join(f"{n} {c}" for c, n in sorted(class_counts.items()))
+                st.image(image, caption=f"{name}: {counts or 'nothing found'}",
+                         use_container_width=True)
+                if result['warning']:
+                    st.warning(result['warning'])
+                for class_name, count in class_counts.items():
+                    totals[class_name] = totals.get(class_name, 0) + count
+        if batch.finished():
+            st.subheader("Totals")
+            st.table(totals)
+            if st.session_state.get('batch_polling') == batch_key:
+                # A full rerun redefines the fragment without the timer
+                st.session_state['batch_polling'] = None
+                st.rerun()
         else:
-            process.process_static_image_box(image_path)
+            st.session_state['batch_polling'] = batch_key
+
+    batch_gallery()
+
+# A recorded row walk can stand in for the camera when testing. Only the
+# operator sets it: visitors must not choose what the server opens.
+LIVE_VIDEO = os.getenv("LIVE_VIDEO")
+
+def live_view():
+    """Stream the camera (or a recorded video) with live detection overlays"""
+    # The frame callback runs on the stream's thread and reads the worker from here
+    live_state = st.session_state.setdefault('live', {})
 
-def handle_image_orientation(image):
-    """Fix image orientation based on EXIF data"""
+    def video_frame_callback(frame):
+        image = frame.to_ndarray(format="rgb24")
+        worker = live_state.get('worker')
+        if worker is None:
+            return frame
+        worker.submit(image)
+        return av.VideoFrame.from_ndarray(worker.annotate(image), format="rgb24")
+
+    if LIVE_VIDEO:
+        ctx = webrtc_streamer(
+            key="live-video",
+            mode=WebRtcMode.RECVONLY,
+            player_factory=lambda: MediaPlayer(LIVE_VIDEO),
+            media_stream_constraints={"video": True, "audio": False},
+            video_frame_callback=video_frame_callback,
+        )
+    else:
+        ctx = webrtc_streamer(
+            key="live-camera",
+            media_stream_constraints={"video": True, "audio": False},
+            video_frame_callback=video_frame_callback,
+        )
+
+    if not ctx.state.playing:
+        return
+    worker = live.LatestFrameWorker(confidence_threshold=confidence_threshold)
+    live_state['worker'] = worker
+    stats_placeholder = st.empty()
     try:
-        exif = image._getexif()
-        if exif:
-            for tag, value in exif.items():
-                if ExifTags.TAGS.get(tag) == 'Orientation':
-                    if value == 3:
-                        image = image.rotate(180, expand=True)
-                    elif value == 6:
-                        image = image.rotate(270, expand=True)
-                    elif value == 8:
-                        image = image.rotate(90, expand=True)
-                    break
-    except (AttributeError, KeyError, IndexError):
-        pass
-    return image
+        while ctx.state.playing:
+            stats_placeholder.json(worker.stats.snapshot())
+            time.sleep(1)
+    finally:
+        # Runs when the stream ends and when a rerun or closed session
+        # interrupts this loop, so no inference thread outlives its stream
+        live_state.pop('worker', None)
+        worker.stop()
 
 if input_option == "Take a Picture":
     img_file_buffer = st.camera_input("Take a picture")
     
     if img_file_buffer:
         # Display original image
-        image = Image.open(img_file_buffer)
-        image = handle_image_orientation(image)
-        st.image(image, caption="Captured Image", use_container_width=True)
-        
-        # Save and process
-        temp_path = "temp_camera.jpg"
-        image.save(temp_path)
+        image_key, image, image_bytes = load_image(img_file_buffer)
+        st.image(st.session_state['preview'], caption="Captured Image", use_container_width=True,
+                 output_format="JPEG")
         
         # Process image
-        process_image(temp_path)
-        
-        # Cleanup
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        process_image(image_key, image, image_bytes)
 
 elif input_option == "Upload Image":
-    uploaded_image = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"])
+    uploaded_images = st.file_uploader("Upload images", type=["jpg", "jpeg", "png"],
+                                       accept_multiple_files=True)
     
-    if uploaded_image:
+    if len(uploaded_images) == 1:
         # Display original image
-        image = Image.open(uploaded_image)
-        image = handle_image_orientation(image)
-        st.image(image, caption="Uploaded Image", use_container_width=True)
-        
-        # Save and process
-        temp_path = f"temp_upload_{uploaded_image.name}"
-        image.save(temp_path)
+        image_key, image, image_bytes = load_image(uploaded_images[0])
+        st.image(st.session_state['preview'], caption="Uploaded Image", use_container_width=True,
+                 output_format="JPEG")
         
         # Process image
-        process_image(temp_path)
-        
-        # Cleanup
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        process_image(image_key, image, image_bytes)
+    elif uploaded_images:
+        show_batch(uploaded_images)
+
+elif input_option == "Live Camera":
+    live_view()
+
+elif input_option == "Upload Video":
+    uploaded_video = st.file_uploader("Upload a video", type=["mp4", "mov", "avi", "mkv"])
+    keyframe_interval = st.sidebar.slider("Keyframe Interval (frames)", 1, 60,
+                                          video.KEYFRAME_INTERVAL)
+
+    if uploaded_video:
+        # Keyframe detections are kept per upload, so a new threshold or
+        # interval only re-runs tracking on the frames already analysed
+        if st.session_state.get('video_upload_id') != uploaded_video.file_id:
+            st.session_state['video_upload_id'] = uploaded_video.file_id
+            st.session_state['video_keyframes'] = {}
+        video_key = (uploaded_video.file_id, keyframe_interval, confidence_threshold)
+        if st.session_state.get('video_key') != video_key:
+            # OpenCV can only read videos from a path
+            suffix = os.path.splitext(uploaded_video.name)[1]
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                input_path = os.path.join(tmp_dir, "input" + suffix)
+                output_path = os.path.join(tmp_dir, "annotated.mp4")
+                with open(input_path, "wb") as f:
+                    f.write(uploaded_video.getvalue())
+
+                progress_bar = st.progress(0.0, text="Analyzing video...")
+                def update_progress(frame_index, frame_count):
+                    if frame_count and frame_index % 10 == 0:
+                        progress_bar.progress(min(1.0, frame_index / frame_count),
+                                              text=f"Analyzing frame {frame_index}/{frame_count}")
+
+                try:
+                    summary = video.analyze_video(input_path, keyframe_interval=keyframe_interval,
+                                                  confidence_threshold=confidence_threshold,
+                                                  output_path=output_path,
+                                                  progress=update_progress,
+                                                  keyframes=st.session_state['video_keyframes'])
+                except (backends.BackendError, IOError) as e:
+                    st.error(f"Video analysis failed: {e}")
+                    st.stop()
+                progress_bar.empty()
+                with open(output_path, "rb") as f:
+                    annotated_video = f.read()
+            st.session_state['video_key'] = video_key
+            st.session_state['video_summary'] = summary
+            st.session_state['annotated_video'] = annotated_video
+
+        summary = st.session_state['video_summary']
+        st.subheader("Plants Counted")
+        st.write(f"{summary['frames']} frames analyzed with "
+                 f"{summary['inference_calls']} inference calls")
+        st.table(summary['counts'])
+        with st.expander("Tracks"):
+            st.dataframe(summary['tracks'])
+        st.download_button("Download annotated video", st.session_state['annotated_video'],
+                           file_name="annotated.mp4", mime="video/mp4")
+
+# Rendered last so it includes the stages of this run
+if telemetry.ENABLED:
+    with st.sidebar.expander("Debug: Pipeline Telemetry"):
+        snapshot = telemetry.snapshot()
+        st.caption("Stage latencies")
+        st.table(snapshot["stages"])
+        st.caption("Counters")
+        st.json(snapshot["counters"])
+        st.caption("API connections")
+        st.json(snapshot["gauges"])
+        st.download_button("Prometheus metrics", telemetry.prometheus_text(),
+                           file_name="metrics.prom", mime="text/plain")
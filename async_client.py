@@ -0,0 +1,151 @@
+"""asyncio client for bulk jobs against the prediction API.
+
+Sends the same fields as process._make_api_request (model, imgsz, conf,
+iou, retina_masks) from a single event loop:
+
+    async with AsyncPredictor(max_concurrency=32, rate=10) as predictor:
+        async for item_id, results, error in predictor.predict_many(items, conf=0.25):
+            ...
+"""
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+import api_client
+import backends
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+load_dotenv()
+
+MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "16"))
+# Requests per second allowed by the API plan; 0 disables rate limiting
+RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "0"))
+RATE_BURST = int(os.getenv("API_RATE_BURST", "0"))
+
+class TokenBucket:
+    """Token-bucket limiter: rate tokens per second, up to capacity banked"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock makes waiters take tokens in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AsyncPredictor:
+    """Concurrency- and rate-limited async access to a RemoteBackend's API"""
+
+    def __init__(self, backend=None, max_concurrency=MAX_CONCURRENCY, rate=RATE_LIMIT,
+                 burst=RATE_BURST, deadline=None):
+        if aiohttp is None:
+            raise backends.BackendError("The async client requires the aiohttp package")
+        self.backend = backend or backends.RemoteBackend()
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline or api_client.CONNECT_TIMEOUT + api_client.READ_TIMEOUT
+        self.bucket = TokenBucket(rate, burst or None) if rate else None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    def _form(self, payload, imgsz, conf, iou, retina_masks):
+        form = aiohttp.FormData()
+        for key, value in self.backend.request_data(imgsz, conf, iou, retina_masks).items():
+            form.add_field(key, str(value))
+        form.add_field("file", payload, filename="image.jpg", content_type="image/jpeg")
+        return form
+
+    async def _post(self, payload, imgsz, conf, iou, retina_masks):
+        """One request with the same retry policy as api_client.post()"""
+        headers = {"x-api-key": self.backend.key}
+        for attempt in range(api_client.MAX_RETRIES + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                async with self._semaphore:
+                    async with self._session.post(
+                        self.backend.url, headers=headers,
+                        data=self._form(payload, imgsz, conf, iou, retina_masks),
+                    ) as response:
+                        if (response.status not in api_client.RETRY_STATUSES
+                                or attempt == api_client.MAX_RETRIES):
+                            response.raise_for_status()
+                            return await response.json()
+                        delay = api_client.retry_after_delay(response)
+            except aiohttp.ClientConnectionError:
+                if attempt == api_client.MAX_RETRIES:
+                    raise
+                delay = None
+            if delay is None:
+                delay = api_client.backoff_delay(attempt)
+            await asyncio.sleep(delay)
+
+    async def predict(self, payload, scale=(1.0, 1.0), conf=0.25, retina_masks=False,
+                      imgsz=640, iou=0.45, deadline=None):
+        """Predict on an encoded upload; raises BackendError on failure or deadline.
+
+        The deadline covers rate-limit and concurrency queueing as well as
+        the request itself.
+        """
+        try:
+            results = await asyncio.wait_for(
+                self._post(payload, imgsz, conf, iou, retina_masks),
+                deadline or self.deadline,
+            )
+        except asyncio.TimeoutError as e:
+            raise backends.BackendError("API request exceeded its deadline") from e
+        except (aiohttp.ClientError, ValueError) as e:
+            raise backends.BackendError(f"API request failed: {e}") from e
+        return backends.scale_results(results, scale)
+
+    async def predict_many(self, items, **kwargs):
+        """Yield (item_id, results, error) in completion order.
+
+        items is an iterable of (item_id, payload, scale). It is consumed
+        lazily so that only about twice max_concurrency uploads are held
+        in memory at once; error is None on success.
+        """
+        async def run(item_id, payload, scale):
+            try:
+                return item_id, await self.predict(payload, scale, **kwargs), None
+            except backends.BackendError as e:
+                return item_id, None, e
+
+        items = iter(items)
+        pending = set()
+        while True:
+            while len(pending) < 2 * self.max_concurrency:
+                item = next(items, None)
+                if item is None:
+                    break
+                pending.add(asyncio.ensure_future(run(*item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
@@ -0,0 +1,391 @@
+import concurrent.futures
+import io
+import os
+import threading
+
+import numpy as np
+import requests
+from dotenv import load_dotenv
+from PIL import Image
+
+import api_client
+import detections
+import fusion
+import telemetry
+
+load_dotenv()
+
+MODEL = os.getenv("MODEL")
+# Comma-separated models that all analyse every image, e.g. a lettuce model
+# and a weed model; entries naming an existing weights file run locally
+MODELS = [m.strip() for m in os.getenv("MODELS", "").split(",") if m.strip()]
+# Cross-model fusion: "weighted" averages the boxes of one plant found by
+# several models, "nms" keeps the most confident one
+MODEL_FUSION = os.getenv("MODEL_FUSION", "weighted")
+MODEL_FUSION_IOU = float(os.getenv("MODEL_FUSION_IOU", "0.55"))
+
+# "remote" for the hosted Ultralytics endpoint, "local" for an in-process
+# model, "ensemble" for all of MODELS at once
+BACKEND = os.getenv("BACKEND", "ensemble" if len(MODELS) > 1 else "remote")
+
+KEY = os.getenv("YOLO_KEY")
+API_URL = os.getenv("API_URL", "https://predict.ultralytics.com")
+
+LOCAL_WEIGHTS = os.getenv("LOCAL_WEIGHTS", "weights/best.pt")
+LOCAL_DEVICE = os.getenv("LOCAL_DEVICE", "cpu")
+
+# How much larger than the model input size the uploaded image may be
+UPLOAD_MARGIN = float(os.getenv("UPLOAD_MARGIN", "1.0"))
+UPLOAD_QUALITY = int(os.getenv("UPLOAD_QUALITY", "90"))
+
+class BackendError(Exception):
+    """Raised when a backend cannot produce a prediction"""
+
+class Backend:
+    """Common interface of all inference backends.
+
+    predict() returns the predict.ultralytics.com response schema:
+    {"images": [{"results": [{"name", "class", "confidence", "box",
+    "segments"}], "shape": [h, w]}]} with coordinates in pixels of img.
+    """
+
+    name = "base"
+    # In-process backends take decoded images; others are sent JPEG uploads
+    in_process = False
+
+    def predict(self, img, imgsz, conf, iou, retina_masks=False):
+        payload, scale = prepare_upload(img, imgsz)
+        return self.predict_payload(payload, scale, imgsz, conf, iou, retina_masks)
+
+    def predict_batch(self, images, imgsz, conf, iou, retina_masks=False, max_workers=8):
+        """Predict on several images; results come back in input order.
+
+        The default runs predict() concurrently, which suits network
+        backends; in-process backends override it with one batched call.
+        """
+        if len(images) <= 1:
+            return [self.predict(img, imgsz, conf, iou, retina_masks) for img in images]
+        with concurrent.futures.ThreadPoolExecutor(min(max_workers, len(images))) as pool:
+            return list(pool.map(lambda img: self.predict(img, imgsz, conf, iou, retina_masks),
+                                 images))
+
+    def predict_payload(self, payload, scale, imgsz, conf, iou, retina_masks=False):
+        """Predict on an encoded image from prepare_upload().
+
+        scale maps coordinates on the payload back onto the original image.
+        """
+        raise NotImplementedError
+
+    def cache_params(self):
+        """Settings that change the output and must be part of the cache key"""
+        return {
+            "backend": self.name,
+            "upload_margin": UPLOAD_MARGIN,
+            "upload_quality": UPLOAD_QUALITY,
+        }
+
+def downscale(img, imgsz):
+    """Shrink an image to the model input size (times UPLOAD_MARGIN).
+
+    Returns the model input and the (x, y) factors that map coordinates
+    on it back onto img.
+    """
+    max_side = max(1, int(imgsz * UPLOAD_MARGIN))
+    scale = max_side / max(img.size)
+    if scale < 1.0:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        small = img.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    else:
+        small = img
+    return small, (img.width / small.width, img.height / small.height)
+
+def prepare_upload(img, imgsz):
+    """Downscale an image to the model input size and re-encode it as JPEG.
+
+    Returns the encoded bytes and the (x, y) factors that map coordinates
+    on the uploaded image back onto the original one.
+    """
+    with telemetry.span("upload_encode"):
+        upload, scale = downscale(img, imgsz)
+        buffer = io.BytesIO()
+        upload.save(buffer, format="JPEG", quality=UPLOAD_QUALITY)
+    return buffer.getvalue(), scale
+
+def scale_results(results, scale):
+    """Map boxes and segments from upload coordinates back to the original image"""
+    sx, sy = scale
+    if sx == 1.0 and sy == 1.0:
+        return results
+
+    for image in results.get("images", []):
+        for detection in image.get("results", []):
+            box = detection.get("box")
+            if box:
+                for key in ("x1", "x2"):
+                    if key in box:
+                        box[key] = float(box[key]) * sx
+                for key in ("y1", "y2"):
+                    if key in box:
+                        box[key] = float(box[key]) * sy
+
+            segments = detection.get("segments")
+            if segments and "x" in segments and "y" in segments:
+                segments["x"] = [float(x) * sx for x in segments["x"]]
+                segments["y"] = [float(y) * sy for y in segments["y"]]
+    return results
+
+def _observe_server_speed(results):
+    """Record the server's own timing (ms per step) when the response has it"""
+    if not telemetry.ENABLED:
+        return
+    for image in results.get("images", []):
+        speed = image.get("speed")
+        if isinstance(speed, dict) and speed:
+            telemetry.observe("server_inference",
+                              sum(float(v) for v in speed.values() if v is not None) / 1000.0)
+
+class RemoteBackend(Backend):
+    """Hosted Ultralytics inference API, or anything serving its schema"""
+
+    name = "remote"
+
+    def __init__(self, model=MODEL, key=KEY, url=API_URL):
+        self.model = model
+        self.key = key
+        self.url = url
+
+    def request_data(self, imgsz, conf, iou, retina_masks=False):
+        """Form fields of a prediction request"""
+        data = {
+            "model": self.model,
+            "imgsz": imgsz,
+            "conf": conf,
+            "iou": iou
+        }
+        if retina_masks:
+            data["retina_masks"] = True
+        return data
+
+    def predict_payload(self, payload, scale, imgsz, conf, iou, retina_masks=False):
+        telemetry.count("upload_bytes", len(payload))
+        try:
+            # Upload, server-side inference and download of the response
+            with telemetry.span("request"):
+                response = api_client.post(
+                    self.url,
+                    headers={"x-api-key": self.key},
+                    data=self.request_data(imgsz, conf, iou, retina_masks),
+                    files={"file": ("image.jpg", payload, "image/jpeg")},
+                )
+            response.raise_for_status()
+            with telemetry.span("json_parse"):
+                results = detections.loads(response.content)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            telemetry.count("api_errors")
+            raise BackendError(f"API request failed: {e}") from e
+        telemetry.count("download_bytes", len(response.content))
+        _observe_server_speed(results)
+        return scale_results(results, scale)
+
+    def cache_params(self):
+        return {**super().cache_params(), "model": self.model, "url": self.url}
+
+_models = {}
+_models_lock = threading.Lock()
+
+def load_yolo(weights, device=LOCAL_DEVICE):
+    """Load a YOLO model once per server process and share it.
+
+    Returns (model, lock); hold the lock while predicting because an
+    Ultralytics predictor is not safe to call from several threads.
+    """
+    key = (os.path.abspath(weights), device)
+    with _models_lock:
+        if key not in _models:
+            try:
+                from ultralytics import YOLO
+            except ImportError as e:
+                raise BackendError("The local backend requires the ultralytics package") from e
+            if not os.path.exists(weights):
+                raise BackendError(f"Model weights not found: {weights}")
+            model = YOLO(weights)
+            _models[key] = (model, threading.Lock())
+        return _models[key]
+
+def yolo_to_schema(result, decimals=5):
+    """Convert an Ultralytics Results object into the API response schema"""
+    height, width = result.orig_shape
+    return {
+        "images": [{
+            "results": result.summary(decimals=decimals),
+            "shape": [height, width],
+            "speed": result.speed,
+        }]
+    }
+
+class LocalYOLOBackend(Backend):
+    """In-process Ultralytics model, loaded once and reused across sessions"""
+
+    name = "local"
+    in_process = True
+
+    def __init__(self, weights=LOCAL_WEIGHTS, device=LOCAL_DEVICE):
+        self.weights = weights
+        self.device = device
+
+    def predict(self, img, imgsz, conf, iou, retina_masks=False):
+        """Downscaled image straight to the model, skipping the JPEG round trip"""
+        return self.predict_batch([img], imgsz, conf, iou, retina_masks)[0]
+
+    def predict_payload(self, payload, scale, imgsz, conf, iou, retina_masks=False):
+        model, lock = load_yolo(self.weights, self.device)
+        try:
+            with Image.open(io.BytesIO(payload)) as img:
+                img = img.convert("RGB")
+            with lock, telemetry.span("inference"):
+                result = model.predict(img, imgsz=imgsz, conf=conf, iou=iou,
+                                       retina_masks=retina_masks, device=self.device,
+                                       verbose=False)[0]
+        except Exception as e:
+            raise BackendError(f"Local inference failed: {e}") from e
+        return scale_results(yolo_to_schema(result), scale)
+
+    def predict_batch(self, images, imgsz, conf, iou, retina_masks=False, max_workers=8):
+        """Run all images through the model as one batch, skipping the JPEG round trip.
+
+        Images are downscaled as for an upload, so a single prediction and
+        a batched or tiled one give the same result for the same image.
+        """
+        model, lock = load_yolo(self.weights, self.device)
+        prepared = [downscale(img, imgsz) for img in images]
+        try:
+            with lock, telemetry.span("inference", batch=len(images)):
+                batch = model.predict([small for small, _ in prepared], imgsz=imgsz, conf=conf,
+                                      iou=iou, retina_masks=retina_masks, device=self.device,
+                                      verbose=False)
+        except Exception as e:
+            raise BackendError(f"Local inference failed: {e}") from e
+        return [scale_results(yolo_to_schema(result), scale)
+                for result, (_, scale) in zip(batch, prepared)]
+
+    def cache_params(self):
+        try:
+            mtime = os.path.getmtime(self.weights)
+        except OSError:
+            mtime = None
+        return {**super().cache_params(), "weights": os.path.abspath(self.weights),
+                "weights_mtime": mtime}
+
+def fuse_results(results_per_model, threshold=MODEL_FUSION_IOU, mode=MODEL_FUSION):
+    """Merge the responses of several models for one image into one response.
+
+    Detections with the same class name are clustered across models by
+    matrix NMS on IoU (class ids are per model and may collide). Each
+    cluster keeps its most confident member's name, confidence and polygon;
+    with mode "weighted" its box is the confidence-weighted mean of the
+    cluster's boxes, as in weighted box fusion.
+    """
+    detections = [d for results in results_per_model
+                  for d in results["images"][0].get("results", []) if d.get("box")]
+    image = {"shape": results_per_model[0]["images"][0].get("shape"), "results": []}
+    if not detections:
+        return {"images": [image]}
+    boxes = np.array([[float(d["box"][k]) for k in ("x1", "y1", "x2", "y2")]
+                      for d in detections], dtype=np.float64)
+    confidences = np.array([float(d.get("confidence", 0.0)) for d in detections])
+    _, class_ids = np.unique([d.get("name", "Unknown") for d in detections], return_inverse=True)
+
+    keep, owner = fusion.cluster(boxes, confidences, class_ids, threshold)
+    if mode == "weighted":
+        fused = fusion.fuse_boxes(boxes, confidences, owner, keep, mode="weighted")
+    else:
+        fused = boxes[keep]
+    for index, box in zip(keep, fused):
+        detection = dict(detections[index])
+        detection["box"] = dict(zip(("x1", "y1", "x2", "y2"), box.tolist()))
+        image["results"].append(detection)
+    return {"images": [image]}
+
+def _member(model):
+    if os.path.exists(model):
+        return LocalYOLOBackend(weights=model)
+    return RemoteBackend(model=model)
+
+class EnsembleBackend(Backend):
+    """Several models queried concurrently for every image, results fused.
+
+    The image is encoded once and the same upload is sent to every model,
+    so the latency is that of the slowest model rather than their sum.
+    """
+
+    name = "ensemble"
+
+    def __init__(self, models=MODELS, members=None):
+        if not models:
+            raise BackendError("The ensemble backend needs MODELS in .env")
+        self.models = list(models)
+        self.members = members or [_member(model) for model in self.models]
+
+    def _fan_out(self, call):
+        """Run call(member) for every member concurrently; results in member order"""
+        with telemetry.span("fan_out", models=len(self.members)), \
+                concurrent.futures.ThreadPoolExecutor(len(self.members)) as pool:
+            futures = [pool.submit(call, member) for member in self.members]
+            outputs = []
+            for model, future in zip(self.models, futures):
+                try:
+                    outputs.append(future.result())
+                except BackendError as e:
+                    raise BackendError(f"{model}: {e}") from e
+        return outputs
+
+    def predict_payload(self, payload, scale, imgsz, conf, iou, retina_masks=False):
+        results = self._fan_out(lambda member: member.predict_payload(
+            payload, scale, imgsz, conf, iou, retina_masks))
+        return fuse_results(results)
+
+    def predict_batch(self, images, imgsz, conf, iou, retina_masks=False, max_workers=8):
+        """Predict every image with every member; fused per image.
+
+        Each image is encoded once and its upload shared by all network
+        members; in-process members run the decoded images as one batch.
+        """
+        payloads = []
+        if not all(member.in_process for member in self.members):
+            with concurrent.futures.ThreadPoolExecutor(max(1, min(max_workers,
+                                                                  len(images)))) as pool:
+                payloads = list(pool.map(lambda img: prepare_upload(img, imgsz), images))
+
+        def predict_member(member):
+            if member.in_process:
+                return member.predict_batch(images, imgsz, conf, iou, retina_masks, max_workers)
+            with concurrent.futures.ThreadPoolExecutor(max(1, min(max_workers,
+                                                                  len(payloads)))) as pool:
+                return list(pool.map(lambda upload: member.predict_payload(
+                    upload[0], upload[1], imgsz, conf, iou, retina_masks), payloads))
+
+        per_model = self._fan_out(predict_member)
+        return [fuse_results(results) for results in zip(*per_model)]
+
+    def cache_params(self):
+        return {**super().cache_params(),
+                "models": [member.cache_params() for member in self.members],
+                "fusion": MODEL_FUSION, "fusion_iou": MODEL_FUSION_IOU}
+
+BACKENDS = {
+    "remote": RemoteBackend,
+    "local": LocalYOLOBackend,
+    "ensemble": EnsembleBackend,
+}
+
+_backends = {}
+
+def get_backend(name=None):
+    """Return the shared backend instance selected by BACKEND in .env"""
+    name = name or BACKEND
+    with _models_lock:
+        if name not in _backends:
+            if name not in BACKENDS:
+                raise BackendError(f"Unknown backend: {name}")
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+import detections
+import telemetry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") != "0"
+CACHE_DIR = os.getenv(
+    "CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "plant_health_monitoring"),
+)
+CACHE_MAX_BYTES = int(float(os.getenv("CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+# Eviction trims the cache down to this fraction of CACHE_MAX_BYTES
+_LOW_WATERMARK = 0.9
+# The running size total is recounted from disk every this many puts, so
+# entries removed behind its back (rm, other tools) do not skew it for long
+_RESCAN_PUTS = 1000
+
+_puts = 0
+
+def image_digest(image_bytes):
+    """Hex SHA-256 of encoded image bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def make_key(image_bytes, **params):
+    """Content address for a prediction: image hash plus request parameters"""
+    return make_digest_key(image_digest(image_bytes), **params)
+
+def make_digest_key(digest, **params):
+    """Like make_key() for callers that already hashed the image"""
+    key = hashlib.sha256(digest.encode("ascii"))
+    key.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    return key.hexdigest()
+
+def _path(key):
+    return os.path.join(CACHE_DIR, key[:2], key + ".json")
+
+def get(key):
+    """Return the cached result for key, or None on a miss"""
+    if not CACHE_ENABLED:
+        return None
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            value = detections.loads(f.read())
+        # Access time is tracked via mtime so LRU works on noatime mounts
+        os.utime(path)
+        telemetry.count("cache_hits")
+        return value
+    except (OSError, ValueError):
+        telemetry.count("cache_misses")
+        return None
+
+def put(key, value):
+    """Store a result atomically and evict old entries if over budget"""
+    if not CACHE_ENABLED:
+        return
+    path = _path(key)
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # Readers in other processes only ever see complete files
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        return
+    _account(len(data) - replaced)
+
+def _entries():
+    for shard in os.scandir(CACHE_DIR):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, entry.path
+
+def _size_path():
+    return os.path.join(CACHE_DIR, ".size")
+
+def _read_size():
+    try:
+        with open(_size_path()) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _write_size(total):
+    try:
+        with open(_size_path(), "w") as f:
+            f.write(str(total))
+    except OSError:
+        pass
+
+def _account(added):
+    """Add a put's bytes to the running total; evict once it exceeds the budget.
+
+    The total lives in CACHE_DIR/.size and is only changed under the lock,
+    so a put costs a small read and write instead of a directory scan.
+    The directory is only scanned when the total is missing, over budget
+    or due for its periodic recount. Entries removed concurrently by
+    another process are simply ignored.
+    """
+    global _puts
+    _puts += 1
+    try:
+        lock = open(os.path.join(CACHE_DIR, ".evict.lock"), "a")
+    except OSError:
+        return
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        total = _read_size()
+        if total is not None and _puts % _RESCAN_PUTS:
+            total += added
+            if total <= CACHE_MAX_BYTES:
+                _write_size(total)
+                return
+        _write_size(_evict())
+    except OSError:
+        pass
+    finally:
+        lock.close()
+
+def _evict():
+    """Delete least recently used entries if the cache exceeds its budget.
+
+    Called with the lock held; returns the size of what is left.
+    """
+    entries = list(_entries())
+    total = sum(size for _, size, _ in entries)
+    if total <= CACHE_MAX_BYTES:
+        return total
+
+    target = CACHE_MAX_BYTES * _LOW_WATERMARK
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= target:
+            break
+    return total
+
+def clear():
+    """Remove every cached result"""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for _, _, path in list(_entries()):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    try:
+        os.remove(_size_path())
+    except FileNotFoundError:
+        pass
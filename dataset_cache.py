@@ -0,0 +1,195 @@
+"""Pre-decoded, memory-mapped image cache for training.
+
+Ultralytics decodes and resizes every JPEG again in every epoch unless the
+whole dataset fits in RAM. prepare() does that work once per split and
+imgsz: each image is decoded with OpenCV (as Ultralytics does), resized so
+its long side is imgsz and letterboxed into one fixed-shape uint8 array
+file. An index alongside it holds every image's path, original and resized
+shape, padding and YOLO labels. train.py's MemmapYOLODataset then serves
+images as slices of that array, so data loader workers only run the
+augmentations.
+
+Disk use is imgsz * imgsz * 3 bytes per image (1.2 MB at 640).
+"""
+import concurrent.futures
+import glob
+import hashlib
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+DATASET_CACHE_DIR = os.getenv(
+    "DATASET_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "plant_health_monitoring", "datasets"),
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+# Letterbox fill, the gray Ultralytics pads with
+PAD_VALUE = 114
+
+def list_images(img_path):
+    """Image files of a split given as a directory, list file or list of either"""
+    sources = img_path if isinstance(img_path, (list, tuple)) else [img_path]
+    files = []
+    for source in sources:
+        source = os.path.realpath(source)
+        if os.path.isdir(source):
+            files.extend(glob.glob(os.path.join(source, "**", "*.*"), recursive=True))
+        elif source.endswith(".txt"):
+            parent = os.path.dirname(source)
+            with open(source) as f:
+                for line in f.read().splitlines():
+                    line = line.strip()
+                    if line:
+                        files.append(os.path.join(parent, line[2:]) if line.startswith("./") else line)
+        else:
+            files.append(source)
+    return sorted(os.path.realpath(f) for f in files
+                  if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+
+def cache_path(img_path, imgsz):
+    """Directory holding the cache of one split at one image size"""
+    sources = img_path if isinstance(img_path, (list, tuple)) else [img_path]
+    key = json.dumps([sorted(os.path.realpath(s) for s in sources), int(imgsz)])
+    return os.path.join(DATASET_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+def letterbox_shape(h0, w0, imgsz):
+    """(h, w, top, left) of an image resized like Ultralytics' load_image and centred"""
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+    else:
+        w, h = w0, h0
+    return h, w, (imgsz - h) // 2, (imgsz - w) // 2
+
+def _signature(files):
+    return [[os.path.getsize(f), os.path.getmtime(f)] for f in files]
+
+def _fill_rows(array_path, files, rows, imgsz):
+    """Process-pool stage: decode, resize and letterbox images into their rows"""
+    images = np.lib.format.open_memmap(array_path, mode="r+")
+    shapes = []
+    for path, row in zip(files, rows):
+        # imdecode rather than imread: applies EXIF orientation like Ultralytics
+        # and copes with non-ASCII Windows paths
+        im = cv2.imdecode(np.fromfile(path, np.uint8), cv2.IMREAD_COLOR)
+        if im is None:
+            shapes.append(None)
+            continue
+        h0, w0 = im.shape[:2]
+        h, w, top, left = letterbox_shape(h0, w0, imgsz)
+        if (h, w) != (h0, w0):
+            im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        images[row] = PAD_VALUE
+        images[row, top:top + h, left:left + w] = im
+        shapes.append((h0, w0, h, w, top, left))
+    images.flush()
+    del images
+    return rows, shapes
+
+def prepare(img_path, imgsz=640, workers=None, chunk_size=64, force=False, log=print):
+    """Build (or reuse) the cache of one split; returns its directory"""
+    files = list_images(img_path)
+    if not files:
+        raise FileNotFoundError(f"No images found in {img_path}")
+    directory = cache_path(img_path, imgsz)
+    index_path = os.path.join(directory, "index.npz")
+    meta_path = os.path.join(directory, "meta.json")
+    signature = _signature(files)
+    if not force and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("files") == files and meta.get("signature") == signature \
+                and meta.get("imgsz") == imgsz:
+            return directory
+
+    os.makedirs(directory, exist_ok=True)
+    array_path = os.path.join(directory, "images.npy")
+    images = np.lib.format.open_memmap(array_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(files), imgsz, imgsz, 3))
+    del images
+    shapes = np.zeros((len(files), 6), dtype=np.int32)
+    valid = np.zeros(len(files), dtype=bool)
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(_fill_rows, array_path, files[start:start + chunk_size],
+                               list(range(start, min(start + chunk_size, len(files)))), imgsz)
+                   for start in range(0, len(files), chunk_size)]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            rows, chunk_shapes = future.result()
+            for row, shape in zip(rows, chunk_shapes):
+                if shape is not None:
+                    shapes[row] = shape
+                    valid[row] = True
+            if log:
+                log(f"Cached {min(done * chunk_size, len(files))}/{len(files)} images")
+
+    # Normalized labels as class, x1, y1, x2, y2 with per-image offsets
+    labels = []
+    offsets = [0]
+    for path in files:
+        classes, boxes, _ = metrics.read_labels(metrics.label_path(path), 1, 1)
+        labels.append(np.column_stack([classes, boxes]).astype(np.float32))
+        offsets.append(offsets[-1] + len(classes))
+    np.savez(index_path, files=np.array(files), shapes=shapes, valid=valid,
+             labels=np.concatenate(labels) if labels else np.zeros((0, 5), np.float32),
+             label_offsets=np.array(offsets, dtype=np.int64))
+    # Written last: a cache without meta.json is incomplete and gets rebuilt
+    with open(meta_path, "w") as f:
+        json.dump({"imgsz": imgsz, "files": files, "signature": signature}, f)
+    return directory
+
+class DatasetCache:
+    """Read-only view of a prepared cache"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        index = np.load(os.path.join(directory, "index.npz"))
+        self.files = index["files"].tolist()
+        self.shapes = index["shapes"]
+        self.valid = index["valid"]
+        self.labels = index["labels"]
+        self.label_offsets = index["label_offsets"]
+        self.rows = {path: row for row, path in enumerate(self.files) if self.valid[row]}
+        self._images = None
+        self.imgsz = self.images.shape[1]
+
+    @property
+    def images(self):
+        """The N x imgsz x imgsz x 3 array, mapped on first use in each process"""
+        if self._images is None:
+            self._images = np.load(os.path.join(self.directory, "images.npy"), mmap_mode="r")
+        return self._images
+
+    def __getstate__(self):
+        # Spawned data loader workers re-map the file instead of receiving a copy
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return len(self.files)
+
+    def image(self, row):
+        """(resized BGR image, (h0, w0), (h, w)) without the letterbox padding"""
+        h0, w0, h, w, top, left = self.shapes[row]
+        return (np.ascontiguousarray(self.images[row, top:top + h, left:left + w]),
+                (int(h0), int(w0)), (int(h), int(w)))
+
+    def letterboxed(self, row):
+        """The full imgsz x imgsz letterboxed BGR image"""
+        return self.images[row]
+
+    def image_labels(self, row):
+        """N x 5 normalized (class, x1, y1, x2, y2) labels of one image"""
+        return self.labels[self.label_offsets[row]:self.label_offsets[row + 1]]
@@ -1,27 +1,230 @@
-import torch
+"""Export the trained model for CPU deployment and compare the formats.
+
+    python deploy.py --weights PHMv25/weights/best.pt --formats onnx openvino openvino-int8 \
+        --calibration datasets/PHM/train/images --data datasets/PHM/data.yaml \
+        --json outputs/deploy.json
+
+Every format is exported with Ultralytics, loaded back, and run on the same
+images (samples/ by default) as the PyTorch model on CPU. The table gives
+per-image latency, throughput, output parity with PyTorch and, when --data
+is given, mAP on its validation split. Point LOCAL_WEIGHTS at the chosen
+export to serve it with the local backend.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+from scipy.optimize import linear_sum_assignment
 from ultralytics import YOLO
-import torch.serialization
-
-# Add safe globals for YOLOv8 DetectionModel
-torch.serialization.add_safe_globals([YOLO])
-
-def load_model(model_path):
-    try:
-        # Load the model with weights_only=True and safe globals added
-        model = torch.load(model_path, weights_only=False)
-        return model
-    except Exception as ex:
-        print(f"Error loading model: {ex}")
-        return None
-
-# Path to your YOLOv8 trained weights
-model_path = r"C:/Users/Yuri/Projects/plant_identification/PHMv25/weights/best.pt"
-
-# Load the model securely
-model = load_model(model_path)
-
-# Check if the model is loaded successfully
-if model is not None:
-    print("Model loaded successfully!")
-else:
-    print(f"Error: Could not load model from {model_path}")
+
+import backends
+import predict
+from fusion import iou_matrix
+
+# name -> Ultralytics export arguments
+FORMATS = {
+    "onnx": {"format": "onnx", "simplify": True},
+    "openvino": {"format": "openvino"},
+    "openvino-int8": {"format": "openvino", "int8": True},
+    "torchscript": {"format": "torchscript"},
+}
+
+# Detections below this confidence are ignored for parity
+PARITY_CONF = 0.25
+# A format passes parity when it reproduces this share of PyTorch detections
+# at this mean IoU...
+PARITY_MIN_RECALL = 0.95
+PARITY_MIN_IOU = 0.9
+# ...and, when mAP is measured, loses at most this much mAP50-95
+MAX_MAP_DROP = 0.01
+
+def calibration_yaml(image_dir, names, size, directory):
+    """Write a data.yaml whose splits are a random subset of image_dir"""
+    images = predict.find_images([image_dir])
+    random.Random(0).shuffle(images)
+    list_path = os.path.join(directory, "calibration.txt")
+    with open(list_path, "w") as f:
+        f.write("\n".join(images[:size]) + "\n")
+    yaml_path = os.path.join(directory, "calibration.yaml")
+    with open(yaml_path, "w") as f:
+        yaml.safe_dump({"train": list_path, "val": list_path,
+                        "names": {int(k): v for k, v in names.items()}}, f)
+    return yaml_path
+
+def export(weights, name, imgsz, data=None):
+    """Export weights to one of FORMATS; returns the exported path"""
+    model = YOLO(weights)
+    arguments = dict(FORMATS[name])
+    if arguments.get("int8"):
+        if data is None:
+            raise ValueError(f"{name} needs --calibration or --data for INT8 calibration")
+        arguments["data"] = data
+    return model.export(imgsz=imgsz, device="cpu", **arguments)
+
+def _detections(result):
+    boxes = result.boxes
+    keep = boxes.conf.numpy() >= PARITY_CONF
+    return (boxes.xyxy.numpy()[keep].astype(np.float64), boxes.cls.numpy()[keep].astype(int),
+            boxes.conf.numpy()[keep])
+
+def parity(reference, candidate):
+    """How closely candidate detections reproduce the reference ones.
+
+    Detections are paired one-to-one by IoU; reports the share of reference
+    detections recovered, their mean IoU, class agreement and mean absolute
+    confidence difference.
+    """
+    matched = total = 0
+    ious, same_class, conf_diff = [], [], []
+    for ref, cand in zip(reference, candidate):
+        ref_boxes, ref_cls, ref_conf = ref
+        cand_boxes, cand_cls, cand_conf = cand
+        total += len(ref_boxes)
+        if not len(ref_boxes) or not len(cand_boxes):
+            continue
+        overlap = iou_matrix(ref_boxes, cand_boxes)
+        rows, cols = linear_sum_assignment(-overlap)
+        good = overlap[rows, cols] >= 0.5
+        rows, cols = rows[good], cols[good]
+        matched += len(rows)
+        ious.extend(overlap[rows, cols])
+        same_class.extend(ref_cls[rows] == cand_cls[cols])
+        conf_diff.extend(np.abs(ref_conf[rows] - cand_conf[cols]))
+    return {
+        "recall": round(matched / total, 4) if total else 1.0,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else 0.0,
+        "class_agreement": round(float(np.mean(same_class)), 4) if same_class else 0.0,
+        "mean_conf_diff": round(float(np.mean(conf_diff)), 4) if conf_diff else 0.0,
+    }
+
+def benchmark(model, images, imgsz, warmup=3, repeats=1):
+    """CPU latency per image and the detections of the last pass"""
+    for path in images[:warmup]:
+        model.predict(path, imgsz=imgsz, device="cpu", verbose=False)
+    latencies = []
+    detections = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        detections = []
+        for path in images:
+            began = time.perf_counter()
+            result = model.predict(path, imgsz=imgsz, device="cpu", verbose=False)[0]
+            latencies.append(time.perf_counter() - began)
+            detections.append(_detections(result))
+    elapsed = time.perf_counter() - start
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "images_per_sec": round(len(latencies) / elapsed, 2),
+    }, detections
+
+def evaluate(model, data, imgsz):
+    """mAP50 / mAP50-95 on the validation split of data"""
+    metrics = model.val(data=data, imgsz=imgsz, device="cpu", plots=False, verbose=False)
+    return {"mAP50": round(float(metrics.box.map50), 4), "mAP50-95": round(float(metrics.box.map), 4)}
+
+def _size_mb(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f))
+                   for root, _, files in os.walk(path) for f in files) / 2**20
+    return os.path.getsize(path) / 2**20
+
+def format_table(rows):
+    header = (f"{'format':<15} {'size MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'img/s':>7} "
+              f"{'recall':>7} {'IoU':>6} {'mAP50':>7} {'mAP50-95':>9}  accept")
+    lines = [header]
+    for row in rows:
+        p = row.get("parity") or {}
+        m = row.get("accuracy") or {}
+        lines.append(
+            f"{row['format']:<15} {row['size_mb']:>8.1f} {row['speed']['p50_ms']:>8.1f} "
+            f"{row['speed']['p95_ms']:>8.1f} {row['speed']['images_per_sec']:>7.2f} "
+            f"{p.get('recall', 1.0):>7.3f} {p.get('mean_iou', 1.0):>6.3f} "
+            f"{m.get('mAP50', float('nan')):>7.3f} {m.get('mAP50-95', float('nan')):>9.3f}  "
+            f"{'ok' if row['acceptable'] else 'FAIL'}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and compare CPU model formats")
+    parser.add_argument("--weights", default=backends.LOCAL_WEIGHTS)
+    parser.add_argument("--formats", nargs="+", choices=sorted(FORMATS),
+                        default=["onnx", "openvino", "openvino-int8"])
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--images", nargs="+", default=["samples"],
+                        help="images for speed and parity (default: samples)")
+    parser.add_argument("--repeats", type=int, default=3, help="passes over the images")
+    parser.add_argument("--data", help="data.yaml for mAP, and INT8 calibration if no --calibration")
+    parser.add_argument("--calibration", help="image directory to draw the INT8 calibration set from")
+    parser.add_argument("--calibration-size", type=int, default=300)
+    parser.add_argument("--min-recall", type=float, default=PARITY_MIN_RECALL,
+                        help="share of PyTorch detections a format must reproduce")
+    parser.add_argument("--min-iou", type=float, default=PARITY_MIN_IOU)
+    parser.add_argument("--max-map-drop", type=float, default=MAX_MAP_DROP)
+    parser.add_argument("--json", help="write the comparison here")
+    args = parser.parse_args()
+
+    images = predict.find_images(args.images)
+    if not images:
+        parser.error("no images found")
+
+    reference = YOLO(args.weights)
+    speed, reference_detections = benchmark(reference, images, args.imgsz, repeats=args.repeats)
+    rows = [{
+        "format": "pytorch",
+        "path": args.weights,
+        "size_mb": round(_size_mb(args.weights), 1),
+        "speed": speed,
+        "parity": None,
+        "accuracy": evaluate(reference, args.data, args.imgsz) if args.data else None,
+        "acceptable": True,
+    }]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        calibration = args.data
+        if args.calibration:
+            calibration = calibration_yaml(args.calibration, reference.names,
+                                           args.calibration_size, tmp_dir)
+        for name in args.formats:
+            try:
+                path = export(args.weights, name, args.imgsz, calibration)
+            except Exception as e:
+                print(f"{name}: export failed: {e}", file=sys.stderr)
+                continue
+            model = YOLO(path, task=reference.task)
+            speed, detections = benchmark(model, images, args.imgsz, repeats=args.repeats)
+            agreement = parity(reference_detections, detections)
+            accuracy = evaluate(model, args.data, args.imgsz) if args.data else None
+            acceptable = agreement["recall"] >= args.min_recall \
+                and agreement["mean_iou"] >= args.min_iou
+            if accuracy is not None:
+                drop = rows[0]["accuracy"]["mAP50-95"] - accuracy["mAP50-95"]
+                acceptable = acceptable and drop <= args.max_map_drop
+            rows.append({
+                "format": name,
+                "path": str(path),
+                "size_mb": round(_size_mb(path), 1),
+                "speed": speed,
+                "parity": agreement,
+                "accuracy": accuracy,
+                "acceptable": acceptable,
+            })
+
+    print(format_table(rows))
+    acceptable = [row for row in rows if row["acceptable"]]
+    fastest = max(acceptable, key=lambda row: row["speed"]["images_per_sec"])
+    print(f"Fastest acceptable format: {fastest['format']} ({fastest['path']})")
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump({"weights": args.weights, "imgsz": args.imgsz, "images": len(images),
+                       "formats": rows, "fastest": fastest["format"]}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Compact, array-backed detection results.
+
+The prediction API answers with one dict per detection and two Python
+lists of floats per polygon. Detections keeps the same information in a
+few NumPy arrays: N x 4 float32 boxes, float32 confidences, class ids,
+and all polygon vertices in one M x 2 float32 buffer with N + 1 offsets.
+Thresholding, scaling and clamping are then single array operations, and
+results kept in session state take a fraction of the memory. Masks stored
+as run lengths (see masks.py) are kept the same way: one x, y, w, h region
+per detection and all run lengths in one buffer with N + 1 offsets.
+"""
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data):
+    """Parse a JSON document (bytes or str), with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _gather(offsets, index):
+    """Element indices and new offsets of the selected ranges of a ragged buffer"""
+    starts = offsets[index]
+    lengths = offsets[index + 1] - starts
+    new_offsets = np.zeros(len(index) + 1, np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    # Every selected element with one fancy index
+    return np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1]), new_offsets
+
+class Detections:
+    """Detections of one image.
+
+    names holds the distinct class names and label indexes into it;
+    class_id is the model's own class number as reported by the backend.
+    """
+
+    __slots__ = ("boxes", "confidence", "class_id", "label", "names",
+                 "polygon_points", "polygon_offsets", "rle_regions", "rle_counts",
+                 "rle_offsets", "shape")
+
+    def __init__(self, boxes, confidence, class_id, label, names, polygon_points,
+                 polygon_offsets, shape=None, rle_regions=None, rle_counts=None,
+                 rle_offsets=None):
+        self.boxes = boxes
+        self.confidence = confidence
+        self.class_id = class_id
+        self.label = label
+        self.names = names
+        self.polygon_points = polygon_points
+        self.polygon_offsets = polygon_offsets
+        self.shape = shape
+        if rle_regions is None:
+            rle_regions = np.zeros((len(boxes), 4), np.int32)
+            rle_counts = np.zeros(0, np.int32)
+            rle_offsets = np.zeros(len(boxes) + 1, np.int64)
+        self.rle_regions = rle_regions
+        self.rle_counts = rle_counts
+        self.rle_offsets = rle_offsets
+
+    @classmethod
+    def empty(cls, shape=None):
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32),
+                   np.zeros(0, np.int32), np.zeros(0, np.int32), (),
+                   np.zeros((0, 2), np.float32), np.zeros(1, np.int64), shape)
+
+    @classmethod
+    def from_results(cls, results):
+        """Build from the API response schema; passes Detections through"""
+        if isinstance(results, cls):
+            return results
+        image = results["images"][0]
+        detections = image.get("results", [])
+        shape = tuple(image["shape"]) if image.get("shape") else None
+        n = len(detections)
+        if n == 0:
+            return cls.empty(shape)
+
+        boxes = np.zeros((n, 4), np.float32)
+        confidence = np.empty(n, np.float32)
+        class_id = np.empty(n, np.int32)
+        label = np.empty(n, np.int32)
+        names = {}
+        lengths = np.zeros(n, np.int64)
+        xs, ys = [], []
+        rle_regions = np.zeros((n, 4), np.int32)
+        rle_lengths = np.zeros(n, np.int64)
+        runs = []
+        for i, detection in enumerate(detections):
+            box = detection.get("box")
+            if box:
+                boxes[i] = (box.get("x1", 0), box.get("y1", 0), box.get("x2", 0), box.get("y2", 0))
+            confidence[i] = detection.get("confidence", 0.0)
+            class_id[i] = detection.get("class", -1)
+            label[i] = names.setdefault(detection.get("name", "Unknown"), len(names))
+            segments = detection.get("segments")
+            if segments and "x" in segments and "y" in segments:
+                count = min(len(segments["x"]), len(segments["y"]))
+                if count:
+                    lengths[i] = count
+                    xs.append(segments["x"][:count])
+                    ys.append(segments["y"][:count])
+            rle = detection.get("rle")
+            if rle:
+                rle_regions[i] = (rle["x"], rle["y"], rle["w"], rle["h"])
+                rle_lengths[i] = len(rle["counts"])
+                runs.append(rle["counts"])
+
+        points = np.empty((int(lengths.sum()), 2), np.float32)
+        if len(points):
+            points[:, 0] = np.concatenate(xs)
+            points[:, 1] = np.concatenate(ys)
+        offsets = np.zeros(n + 1, np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        rle_offsets = np.zeros(n + 1, np.int64)
+        np.cumsum(rle_lengths, out=rle_offsets[1:])
+        rle_counts = np.concatenate(runs).astype(np.int32) if runs else np.zeros(0, np.int32)
+        return cls(boxes, confidence, class_id, label, tuple(names), points, offsets, shape,
+                   rle_regions, rle_counts, rle_offsets)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def polygon_lengths(self):
+        return np.diff(self.polygon_offsets)
+
+    def class_names(self):
+        """Class name of every detection"""
+        return [self.names[i] for i in self.label.tolist()]
+
+    def polygon(self, i):
+        """K x 2 vertices of detection i (a view into the shared buffer)"""
+        return self.polygon_points[self.polygon_offsets[i]:self.polygon_offsets[i + 1]]
+
+    def mask(self, i):
+        """(x, y, h x w boolean mask) of detection i's run-length mask, or None"""
+        x, y, w, h = self.rle_regions[i].tolist()
+        counts = self.rle_counts[self.rle_offsets[i]:self.rle_offsets[i + 1]]
+        if not len(counts):
+            return None
+        values = np.arange(len(counts)) % 2 == 1
+        return x, y, np.repeat(values, counts)[:w * h].reshape(h, w)
+
+    def select(self, index):
+        """Subset by boolean mask or integer indices, keeping polygon buffers compact"""
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        point_index, offsets = _gather(self.polygon_offsets, index)
+        run_index, rle_offsets = _gather(self.rle_offsets, index)
+        return Detections(self.boxes[index], self.confidence[index], self.class_id[index],
+                          self.label[index], self.names, self.polygon_points[point_index],
+                          offsets, self.shape, self.rle_regions[index],
+                          self.rle_counts[run_index], rle_offsets)
+
+    def above(self, confidence_threshold):
+        """Detections at or above the confidence threshold"""
+        if len(self) == 0 or self.confidence.min() >= confidence_threshold:
+            return self
+        return self.select(self.confidence >= confidence_threshold)
+
+    def scaled(self, sx, sy):
+        """Copy with coordinates multiplied by (sx, sy); run-length masks cannot be scaled"""
+        if len(self.rle_counts) and (sx, sy) != (1, 1):
+            raise ValueError("Run-length masks cannot be scaled")
+        factor = np.array([sx, sy], np.float32)
+        return Detections(self.boxes * np.tile(factor, 2), self.confidence, self.class_id,
+                          self.label, self.names, self.polygon_points * factor,
+                          self.polygon_offsets, self.shape, self.rle_regions, self.rle_counts,
+                          self.rle_offsets)
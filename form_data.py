@@ -0,0 +1,21 @@
+"""multipart/form-data parsing for the servers that speak the prediction API.
+
+Not called multipart.py, which would shadow the python-multipart package.
+"""
+import email.parser
+import email.policy
+
+def parse_multipart(content_type, body):
+    """Split a multipart/form-data body into (fields, files) dicts"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None:
+            files[name] = payload
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
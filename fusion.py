@@ -0,0 +1,122 @@
+import numpy as np
+
+def iou_matrix(a, b):
+    """Pairwise IoU of N x 4 and M x 4 xyxy box arrays"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    inter = _intersection(a, b)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def ios_matrix(a, b):
+    """Pairwise intersection over the smaller box of N x 4 and M x 4 boxes.
+
+    Unlike IoU this stays high when one box is a clipped part of the
+    other, as happens to objects cut by a tile border.
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    inter = _intersection(a, b)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-9)
+
+def _intersection(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    return np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+def nms(boxes, scores, classes=None, threshold=0.5, metric="iou"):
+    """Matrix NMS: indices of kept boxes, highest score first.
+
+    All pairwise overlaps are computed at once; a box is suppressed when a
+    higher-scoring box of the same class overlaps it above threshold.
+    Boxes suppressed only by boxes that are themselves suppressed are
+    still dropped (Fast NMS), which costs a little recall but needs no
+    sequential loop.
+    """
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    if len(order) == 0:
+        return order
+    boxes = np.asarray(boxes, dtype=np.float64)[order]
+    overlap = (ios_matrix if metric == "ios" else iou_matrix)(boxes, boxes)
+    if classes is not None:
+        classes = np.asarray(classes)[order]
+        overlap = overlap * (classes[:, None] == classes[None, :])
+    overlap = np.triu(overlap, k=1)
+    keep = overlap.max(axis=0) <= threshold
+    return order[keep]
+
+def cluster(boxes, scores, classes=None, threshold=0.5, metric="iou"):
+    """Matrix NMS that also reports which suppressed boxes each keeper absorbed.
+
+    Returns (keep, owner): keep as for nms(), and owner[i] is the index of
+    the kept box that box i was merged into (itself for kept boxes).
+
+    Fast NMS may drop a box whose only suppressor was itself suppressed;
+    such a box overlaps no keeper, so it would belong to no cluster. These
+    orphans are run through NMS again and the survivors become keepers,
+    until every box has an owner, which gives the same keepers as greedy
+    NMS.
+    """
+    scores = np.asarray(scores)
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if classes is not None:
+        classes = np.asarray(classes)
+    owner = np.arange(len(boxes))
+    keep = nms(boxes, scores, classes, threshold, metric)
+    if len(keep) == 0:
+        return keep, owner
+    overlap = (ios_matrix if metric == "ios" else iou_matrix)(boxes, boxes)
+    if classes is not None:
+        overlap = overlap * (classes[:, None] == classes[None, :])
+    while True:
+        # Each dropped box joins the best-scoring keeper it overlaps
+        eligible = (overlap[:, keep] > threshold) & (scores[keep][None, :] >= scores[:, None])
+        has_owner = eligible.any(axis=1)
+        has_owner[keep] = True
+        orphans = np.flatnonzero(~has_owner)
+        if len(orphans) == 0:
+            break
+        kept = nms(boxes[orphans], scores[orphans],
+                   None if classes is None else classes[orphans], threshold, metric)
+        keep = np.concatenate([keep, orphans[kept]])
+    keep = keep[np.argsort(-scores[keep], kind="stable")]
+    eligible = (overlap[:, keep] > threshold) & (scores[keep][None, :] >= scores[:, None])
+    ranked = np.where(eligible, scores[keep][None, :], -np.inf)
+    has_owner = eligible.any(axis=1)
+    owner[has_owner] = keep[ranked[has_owner].argmax(axis=1)]
+    owner[keep] = keep
+    return keep, owner
+
+def fuse_boxes(boxes, scores, owner, keep, mode="union"):
+    """Combine each keeper's cluster into one box.
+
+    mode "union" takes the enclosing box, which restores objects split by
+    tile borders; "weighted" averages coordinates by score as in weighted
+    box fusion.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    scores = np.asarray(scores, dtype=np.float64)
+    fused = boxes[keep].copy()
+    if len(keep) == 0:
+        return fused
+    slot = np.full(len(boxes), -1)
+    slot[keep] = np.arange(len(keep))
+    member = slot[owner]
+    valid = member >= 0
+    if mode == "union":
+        np.minimum.at(fused[:, 0], member[valid], boxes[valid, 0])
+        np.minimum.at(fused[:, 1], member[valid], boxes[valid, 1])
+        np.maximum.at(fused[:, 2], member[valid], boxes[valid, 2])
+        np.maximum.at(fused[:, 3], member[valid], boxes[valid, 3])
+    else:
+        weights = np.zeros(len(keep))
+        np.add.at(weights, member[valid], scores[valid])
+        sums = np.zeros((len(keep), 4))
+        np.add.at(sums, member[valid], boxes[valid] * scores[valid, None])
+        fused = sums / np.maximum(weights[:, None], 1e-9)
+    return fused
@@ -0,0 +1,132 @@
+"""Background analysis of many uploaded images at once.
+
+Growers upload a whole walk's photos in one go. Every image is decoded,
+analysed and recorded on a thread pool shared by all sessions of the
+server, so the script run that queued them returns at once; app.py polls
+the futures from a fragment and fills the gallery as they finish. Each
+image is kept as a gallery-sized JPEG with its detections, so moving the
+confidence slider or switching the mode only redraws them locally, and a
+few hundred of them stay small in session state.
+"""
+import collections
+import concurrent.futures
+import io
+import os
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+from PIL import Image
+
+import cache
+import ingest
+import observations
+import process
+import telemetry
+
+load_dotenv()
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+# Longest side of the annotated images shown in the gallery
+GALLERY_MAX_SIDE = int(os.getenv("GALLERY_MAX_SIDE", "800"))
+GALLERY_QUALITY = 85
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """The analysis thread pool shared by every session of this server"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(ANALYSIS_WORKERS,
+                                                          thread_name_prefix="analysis")
+        return _pool
+
+def analyze(name, image_bytes, tiled, plot):
+    """Worker: decode, analyse and record one image.
+
+    Raises backends.BackendError when inference fails. Detections are
+    fetched at CONF_FLOOR so the gallery can be redrawn at any threshold
+    and mode without another request. Returns a dict with the clean image
+    as JPEG, its detections and any warning about recording.
+    """
+    with telemetry.span("gallery_image"):
+        digest = cache.image_digest(image_bytes)
+        ingested = ingest.IngestedImage(image_bytes, process.working_max_side())
+        image = ingested.image
+        detections = process.request_results(image, image_bytes, process.CONF_FLOOR,
+                                             retina_masks=True, tiled=tiled)
+
+        warning = None
+        try:
+            observations.record(digest, detections, image.size, plot, exif=ingested.exif,
+                                full_size=ingested.full_size, name=name)
+        except sqlite3.Error as e:
+            warning = f"Could not save observation: {e}"
+
+        # Polygons scale with the image; run-length masks keep the working size
+        if not len(detections.rle_counts):
+            working_size = image.size
+            image = image.copy()
+            image.thumbnail((GALLERY_MAX_SIDE, GALLERY_MAX_SIDE), reducing_gap=2.0)
+            detections = detections.scaled(image.width / working_size[0],
+                                           image.height / working_size[1])
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=GALLERY_QUALITY)
+    return {
+        "name": name,
+        "image": buffer.getvalue(),
+        "detections": detections,
+        "warning": warning,
+    }
+
+def render(result, segment, confidence_threshold):
+    """Annotated gallery JPEG and per-class counts of an analysed image.
+
+    The last rendering is kept in result, so reruns that change neither
+    the threshold nor the mode draw nothing.
+    """
+    key = (segment, confidence_threshold)
+    if result.get("rendered_key") != key:
+        detections = result["detections"].above(confidence_threshold)
+        draw = process.draw_segments if segment else process.draw_boxes
+        with Image.open(io.BytesIO(result["image"])) as image:
+            annotated, _ = draw(image.convert("RGB"), detections, confidence_threshold)
+        annotated.thumbnail((GALLERY_MAX_SIDE, GALLERY_MAX_SIDE), reducing_gap=2.0)
+        buffer = io.BytesIO()
+        annotated.save(buffer, format="JPEG", quality=GALLERY_QUALITY)
+        result["rendered"] = buffer.getvalue()
+        result["counts"] = dict(collections.Counter(detections.class_names()))
+        result["rendered_key"] = key
+    return result["rendered"], result["counts"]
+
+class Batch:
+    """The analyses of one upload, submitted once and reused across reruns"""
+
+    def __init__(self, files, tiled, plot):
+        pool = get_pool()
+        self.names = [name for name, _ in files]
+        self.futures = [pool.submit(analyze, name, data, tiled, plot) for name, data in files]
+
+    def __len__(self):
+        return len(self.futures)
+
+    def done(self):
+        return sum(future.done() for future in self.futures)
+
+    def finished(self):
+        return self.done() == len(self.futures)
+
+    def cancel(self):
+        """Drop images still waiting in the queue"""
+        for future in self.futures:
+            future.cancel()
+
+    def results(self):
+        """(name, result or None, error or None) of every finished image, in upload order"""
+        for name, future in zip(self.names, self.futures):
+            if not future.done() or future.cancelled():
+                continue
+            error = future.exception()
+            yield name, None if error else future.result(), error
@@ -0,0 +1,76 @@
+import io
+import os
+
+from dotenv import load_dotenv
+from PIL import ExifTags, Image
+
+import telemetry
+
+load_dotenv()
+
+# Longest side of the working copy used for previews and model uploads
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", "1000"))
+
+# One transpose per EXIF orientation; 1 (and missing) needs none
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def decode(image_bytes, max_side=None):
+    """Decode upright RGB pixels, at reduced scale when max_side is given.
+
+    JPEGs are decoded with draft mode, so libjpeg scales by 1/2, 1/4 or
+    1/8 during decoding instead of producing all 12 MP first. Returns
+    (image, full_size, exif) where full_size is the upright size of the
+    undecoded original.
+    """
+    with telemetry.span("decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        exif = img.getexif()
+        orientation = exif.get(ExifTags.Base.Orientation, 1)
+        method = _ORIENTATION_TRANSPOSE.get(orientation)
+
+        full_size = img.size
+        if method in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                      Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270):
+            full_size = (full_size[1], full_size[0])
+
+        if max_side and max(img.size) > max_side:
+            scale = max_side / max(img.size)
+            if img.format == "JPEG":
+                img.draft("RGB", (int(img.width * scale) + 1, int(img.height * scale) + 1))
+            img = img.convert("RGB")
+            img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+        else:
+            img = img.convert("RGB")
+
+    if method is not None:
+        with telemetry.span("orient"):
+            img = img.transpose(method)
+    return img, full_size, exif
+
+class IngestedImage:
+    """An upload's encoded bytes plus an upright working copy of its pixels.
+
+    The full-resolution original is only decoded by full_image(), for
+    exports that need it.
+    """
+
+    def __init__(self, image_bytes, max_side=PREVIEW_MAX_SIDE):
+        self.image_bytes = image_bytes
+        self.image, self.full_size, self.exif = decode(image_bytes, max_side)
+
+    @property
+    def scale(self):
+        """(x, y) factors mapping working-copy coordinates onto the original"""
+        return (self.full_size[0] / self.image.width, self.full_size[1] / self.image.height)
+
+    def full_image(self):
+        """Decode the original at full resolution"""
+        return decode(self.image_bytes)[0]
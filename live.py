@@ -1,11 +1,212 @@
-from ultralytics import YOLO
+"""Real-time monitoring with latest-frame-wins scheduling.
 
-best_pt = 'C:/Users/Yuri/Projects/plant_identification/weights/phm28.pt'
+Frames arrive on a capture thread; a single inference worker always takes
+the newest frame and drops any it did not get to, so overlays never lag
+further behind the camera than one inference. Used by the "Live Camera"
+mode of app.py, or standalone in a desktop window:
 
-# weights = 'C:/Users/Yuri/Projects/plant_identification/runs/detect/PHM26/weights/best.pt'
+    python live.py --source 0
+    python live.py --source row_walk.mp4     # recorded video as a stand-in camera
+"""
+import argparse
+import collections
+import logging
+import threading
+import time
 
-model = YOLO(best_pt)
+import cv2
+import numpy as np
+from PIL import Image
 
-results = model(source=0, conf=0.25, show=True, save=True)
+import backends
+import process
+import render
 
-# results.show()
\ No newline at end of file
+_logger = logging.getLogger("plant_health.live")
+
+class LiveStats:
+    """Rolling per-stage latencies (ms) and event counters"""
+
+    def __init__(self, window=120):
+        self._lock = threading.Lock()
+        self._durations = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._events = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._counts = collections.Counter()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._durations[stage].append(seconds * 1000.0)
+
+    def tick(self, event):
+        """Count an event and remember when it happened, for rates"""
+        now = time.perf_counter()
+        with self._lock:
+            self._counts[event] += 1
+            self._events[event].append(now)
+
+    def snapshot(self):
+        with self._lock:
+            latency = {stage: {"mean_ms": round(float(np.mean(values)), 1),
+                               "p95_ms": round(float(np.percentile(values, 95)), 1)}
+                       for stage, values in self._durations.items() if values}
+            fps = {}
+            for event, times in self._events.items():
+                if len(times) > 1 and times[-1] > times[0]:
+                    fps[event] = round((len(times) - 1) / (times[-1] - times[0]), 1)
+            return {"latency": latency, "fps": fps, "counts": dict(self._counts)}
+
+class LatestFrameWorker:
+    """Runs inference on the newest submitted frame, dropping stale ones"""
+
+    def __init__(self, backend=None, confidence_threshold=0.25):
+        self.backend = backend or backends.get_backend()
+        # Fetched at the floor so the threshold can change without new requests
+        self.confidence_threshold = confidence_threshold
+        self.stats = LiveStats()
+        self._condition = threading.Condition()
+        self._frame = None
+        self._result = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="live-inference", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """Offer an RGB frame (H x W x 3 uint8); replaces any frame still waiting"""
+        with self._condition:
+            if self._frame is not None:
+                self.stats.tick("dropped")
+            self._frame = (frame, time.perf_counter())
+            self._condition.notify()
+        self.stats.tick("captured")
+
+    def latest(self):
+        """(results, frame_timestamp) of the newest finished inference, or None"""
+        return self._result
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._frame is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                frame, captured_at = self._frame
+                self._frame = None
+
+            start = time.perf_counter()
+            self.stats.record("queue", start - captured_at)
+            try:
+                results = self.backend.predict(Image.fromarray(frame), process.IMGSZ,
+                                               process.CONF_FLOOR, process.IOU)
+            except backends.BackendError:
+                self.stats.tick("errors")
+                continue
+            except Exception:
+                # Anything else would silently end the thread and freeze the overlays
+                _logger.exception("Live inference failed")
+                self.stats.tick("errors")
+                continue
+            done = time.perf_counter()
+            self.stats.record("inference", done - start)
+            self.stats.record("frame_to_result", done - captured_at)
+            self.stats.tick("inferred")
+            self._result = (results, captured_at)
+
+    def annotate(self, frame):
+        """Draw the latest result over frame and return the annotated array"""
+        latest = self._result
+        if latest is None:
+            return frame
+        start = time.perf_counter()
+        annotated, _ = render.render_boxes(Image.fromarray(frame), latest[0],
+                                           self.confidence_threshold)
+        self.stats.record("render", time.perf_counter() - start)
+        self.stats.tick("displayed")
+        return np.asarray(annotated)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout=5)
+
+class CaptureThread:
+    """Reads frames from a camera index or video file and feeds a worker.
+
+    Video files are paced at their native frame rate so they behave like a
+    live camera; the newest frame is also kept for display.
+    """
+
+    def __init__(self, source, worker, loop=True):
+        self.capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video source: {source}")
+        self.is_file = not str(source).isdigit()
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if self.is_file and fps > 0 else 0.0
+        self.worker = worker
+        self.loop = loop
+        self.frame = None
+        self.frame_id = 0
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="live-capture", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_frame = time.perf_counter()
+        previous = None
+        while self.running:
+            ok, bgr = self.capture.read()
+            if not ok:
+                if self.is_file and self.loop:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+            now = time.perf_counter()
+            if previous is not None:
+                self.worker.stats.record("capture_interval", now - previous)
+            previous = now
+            frame = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+            self.frame = frame
+            self.frame_id += 1
+            self.worker.submit(frame)
+            if self.frame_interval:
+                next_frame += self.frame_interval
+                time.sleep(max(0.0, next_frame - time.perf_counter()))
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        self._thread.join(timeout=5)
+        self.capture.release()
+
+def main():
+    parser = argparse.ArgumentParser(description="Live lettuce health monitoring")
+    parser.add_argument("--source", default="0", help="camera index or video file")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default=backends.BACKEND)
+    args = parser.parse_args()
+
+    worker = LatestFrameWorker(backends.get_backend(args.backend), args.conf)
+    capture = CaptureThread(args.source, worker)
+    last_report = time.perf_counter()
+    shown_id = 0
+    try:
+        while capture.running:
+            frame = capture.frame
+            if frame is not None and capture.frame_id != shown_id:
+                shown_id = capture.frame_id
+                annotated = worker.annotate(frame)
+                cv2.imshow("Lettuce Health Monitoring", cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR))
+            if cv2.waitKey(15) & 0xFF == ord("q"):
+                break
+            if time.perf_counter() - last_report > 5:
+                print(worker.stats.snapshot())
+                last_report = time.perf_counter()
+    finally:
+        capture.stop()
+        worker.stop()
+        cv2.destroyAllWindows()
+
+if __name__ == "__main__":
+    main()
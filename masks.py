@@ -0,0 +1,125 @@
+"""Compact mask representations for segmentation results.
+
+With retina_masks the API traces every mask at full resolution, one
+vertex per boundary pixel. Before results are cached they are reduced in
+one of two ways, chosen by MASK_FORMAT:
+
+- "polygon": each polygon is simplified with Douglas-Peucker at
+  MASK_SIMPLIFY_TOLERANCE pixels. A simplified polygon is only kept when
+  its rasterized mask still has at least MASK_MIN_IOU IoU with the
+  original one; otherwise the tolerance is halved once, then the original
+  is kept.
+- "rle": each polygon is rasterized exactly as the renderer would draw it
+  and stored as a run-length encoded mask of its bounding box, which the
+  renderer pastes without rasterizing anything.
+"""
+import os
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image, ImageDraw
+
+load_dotenv()
+
+MASK_FORMAT = os.getenv("MASK_FORMAT", "polygon")
+MASK_SIMPLIFY_TOLERANCE = float(os.getenv("MASK_SIMPLIFY_TOLERANCE", "1.0"))
+MASK_MIN_IOU = float(os.getenv("MASK_MIN_IOU", "0.98"))
+# Decimals kept on polygon coordinates
+MASK_DECIMALS = 1
+
+def cache_params(mask_format=MASK_FORMAT):
+    """Settings that change the stored masks and must be part of the cache key"""
+    if mask_format == "rle":
+        return {"format": "rle"}
+    return {"format": mask_format, "tolerance": MASK_SIMPLIFY_TOLERANCE,
+            "min_iou": MASK_MIN_IOU, "decimals": MASK_DECIMALS}
+
+def simplify(points, tolerance=MASK_SIMPLIFY_TOLERANCE):
+    """Douglas-Peucker simplification of a closed K x 2 polygon"""
+    if tolerance <= 0 or len(points) <= 3:
+        return points
+    simplified = cv2.approxPolyDP(np.asarray(points, np.float32).reshape(-1, 1, 2),
+                                  tolerance, True)
+    return simplified.reshape(-1, 2)
+
+def _region(points, width, height):
+    """Integer (x, y, w, h) of the pixels a clamped polygon can touch"""
+    x0, y0 = np.floor(points.min(axis=0)).astype(int).tolist()
+    x1, y1 = (np.floor(points.max(axis=0)).astype(int) + 2).tolist()
+    x0, y0 = max(0, x0), max(0, y0)
+    return x0, y0, max(0, min(width, x1) - x0), max(0, min(height, y1) - y0)
+
+def rasterize(points, region):
+    """Boolean h x w mask of a polygon inside region, pixel-identical to render.py"""
+    x0, y0, w, h = region
+    # Drawn as render.py fills: Pillow's blending mode covers slightly
+    # different edge pixels than a plain fill, and shifting a polygon
+    # sideways can move them too, so only rows are offset
+    canvas = Image.new("RGB", (max(x0 + w, 1), max(h, 1)), 0)
+    if len(points) > 2:
+        ImageDraw.Draw(canvas, "RGBA").polygon((points - (0, y0)).ravel().tolist(),
+                                               fill=(1, 1, 1, 255))
+    mask = canvas.crop((x0, 0, x0 + max(w, 1), max(h, 1))).getchannel(0)
+    return np.asarray(mask, dtype=bool)[:h, :w]
+
+def mask_iou(a, b):
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+def encode_rle(mask):
+    """Row-major run lengths of a boolean mask, starting with a background run.
+
+    Detections.mask() decodes them.
+    """
+    flat = mask.ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [len(flat)])))
+    if len(flat) and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts
+
+def _clamped(segments, width, height):
+    points = np.column_stack([segments["x"][:len(segments["y"])],
+                              segments["y"][:len(segments["x"])]]).astype(np.float64)
+    np.clip(points[:, 0], 0, width, out=points[:, 0])
+    np.clip(points[:, 1], 0, height, out=points[:, 1])
+    return np.round(points, MASK_DECIMALS)
+
+def _simplified(points, width, height, tolerance, min_iou):
+    region = _region(points, width, height)
+    original = None
+    for attempt in (tolerance, tolerance / 2):
+        simplified = simplify(points, attempt)
+        if len(simplified) == len(points):
+            return points
+        if original is None:
+            original = rasterize(points, region)
+        if mask_iou(original, rasterize(simplified, region)) >= min_iou:
+            return np.round(simplified.astype(np.float64), MASK_DECIMALS)
+    return points
+
+def compact_results(results, size, mask_format=MASK_FORMAT,
+                    tolerance=MASK_SIMPLIFY_TOLERANCE, min_iou=MASK_MIN_IOU):
+    """Reduce the masks of an API response in place; returns it.
+
+    size is the (width, height) the coordinates refer to; polygons are
+    clamped to it as the renderer would.
+    """
+    width, height = size
+    for image in results.get("images", []):
+        for detection in image.get("results", []):
+            segments = detection.get("segments")
+            if not segments or not segments.get("x") or not segments.get("y"):
+                continue
+            points = _clamped(segments, width, height)
+            if mask_format == "rle":
+                region = _region(points, width, height)
+                x, y, w, h = region
+                detection["rle"] = {"x": x, "y": y, "w": w, "h": h,
+                                    "counts": encode_rle(rasterize(points, region)).tolist()}
+                del detection["segments"]
+            else:
+                points = _simplified(points, width, height, tolerance, min_iou)
+                detection["segments"] = {"x": points[:, 0].tolist(), "y": points[:, 1].tolist()}
+    return results
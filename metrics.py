@@ -0,0 +1,421 @@
+"""Detection and segmentation metrics against YOLO-format label files.
+
+Scores the JSONL written by predict.py, so any backend can be evaluated:
+
+    python predict.py datasets/PHM/valid/images -o outputs/valid.jsonl --conf 0.001
+    python metrics.py outputs/valid.jsonl --task segment --json outputs/metrics.json
+
+Labels are looked up next to each image the YOLO way (.../images/x.jpg ->
+.../labels/x.txt) or in --labels. The JSONL is read in chunks that are
+matched on a process pool; each chunk returns only compact per-prediction
+arrays, which are reduced into per-class precision, recall, mAP50,
+mAP50-95 and a confusion matrix at the end.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image, ImageDraw
+
+from fusion import iou_matrix
+
+load_dotenv()
+
+# Class order of the label files (Roboflow exports sort names alphabetically)
+CLASS_NAMES = os.getenv("CLASS_NAMES", "disease_lettuce,normal_lettuce,weed").split(",")
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+# Longest side masks are rasterized at for mask IoU
+MASK_SIZE = 256
+
+# Operating point of the confusion matrix, as in Ultralytics' val plots
+CONFUSION_CONF = 0.25
+CONFUSION_IOU = 0.45
+
+def label_path(image_path, labels_dir=None):
+    """YOLO label file belonging to an image"""
+    stem = os.path.splitext(os.path.basename(image_path))[0] + ".txt"
+    if labels_dir:
+        return os.path.join(labels_dir, stem)
+    parts = os.path.normpath(image_path).split(os.sep)
+    if "images" in parts:
+        index = len(parts) - 1 - parts[::-1].index("images")
+        parts[index] = "labels"
+    return os.path.join(os.sep.join(parts[:-1]), stem)
+
+def read_labels(path, width, height):
+    """(classes, xyxy pixel boxes, pixel polygons) from a YOLO label file.
+
+    Lines are either "class cx cy w h" or segmentation polygons
+    "class x1 y1 x2 y2 ...", all normalized. A missing file means an image
+    without objects.
+    """
+    classes, boxes, polygons = [], [], []
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+    scale = np.array([width, height], dtype=np.float64)
+    for line in lines:
+        values = line.split()
+        if len(values) < 5:
+            continue
+        classes.append(int(float(values[0])))
+        coords = np.asarray(values[1:], dtype=np.float64)
+        if len(coords) == 4:
+            cx, cy, w, h = coords * np.tile(scale, 2)
+            box = (cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2)
+            polygon = np.array([[box[0], box[1]], [box[2], box[1]], [box[2], box[3]], [box[0], box[3]]])
+        else:
+            polygon = coords[:len(coords) // 2 * 2].reshape(-1, 2) * scale
+            box = (*polygon.min(axis=0), *polygon.max(axis=0))
+        boxes.append(box)
+        polygons.append(polygon)
+    return (np.asarray(classes, dtype=np.int64),
+            np.asarray(boxes, dtype=np.float64).reshape(-1, 4), polygons)
+
+def read_predictions(record, names):
+    """(classes, confidences, xyxy boxes, polygons, unknown) from one predict.py record.
+
+    Detections are mapped to the dataset's classes by name. The model's
+    own class id is only used for detections without a name, and only
+    when it is a valid dataset class; ids from another model (e.g. an
+    ensemble member) mean nothing here. Detections of any other class are
+    skipped and counted in unknown.
+    """
+    index = {name: i for i, name in enumerate(names)}
+    classes, confidences, boxes, polygons = [], [], [], []
+    unknown = 0
+    for detection in record.get("results", []):
+        box = detection.get("box")
+        if not box:
+            continue
+        if "name" in detection:
+            class_id = index.get(detection["name"])
+        else:
+            class_id = detection.get("class")
+            if class_id is not None and not 0 <= int(class_id) < len(names):
+                class_id = None
+        if class_id is None:
+            unknown += 1
+            continue
+        classes.append(int(class_id))
+        confidences.append(float(detection.get("confidence", 0.0)))
+        boxes.append([float(box[k]) for k in ("x1", "y1", "x2", "y2")])
+        segments = detection.get("segments") or {}
+        if segments.get("x"):
+            polygons.append(np.column_stack([segments["x"], segments["y"]]).astype(np.float64))
+        else:
+            x1, y1, x2, y2 = boxes[-1]
+            polygons.append(np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]))
+    return (np.asarray(classes, dtype=np.int64), np.asarray(confidences, dtype=np.float64),
+            np.asarray(boxes, dtype=np.float64).reshape(-1, 4), polygons, unknown)
+
+def rasterize(polygons, width, height, mask_size=MASK_SIZE):
+    """K x (h*w) boolean masks of pixel polygons at reduced resolution"""
+    scale = mask_size / max(width, height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    masks = np.zeros((len(polygons), size[0] * size[1]), dtype=bool)
+    for i, polygon in enumerate(polygons):
+        if len(polygon) < 3:
+            continue
+        canvas = Image.new("1", size)
+        ImageDraw.Draw(canvas).polygon((polygon * scale).ravel().tolist(), fill=1)
+        masks[i] = np.asarray(canvas).ravel()
+    return masks
+
+def mask_iou(a, b):
+    """Pairwise IoU of K x P and M x P flattened boolean masks"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    inter = a @ b.T
+    union = a.sum(axis=1)[:, None] + b.sum(axis=1)[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+def match_predictions(pred_classes, gt_classes, iou, thresholds=IOU_THRESHOLDS):
+    """N x T true-positive matrix: greedy one-to-one matching per IoU threshold.
+
+    iou is the G x N overlap of labels and predictions; pairs of different
+    classes never match, and each label is taken by its best-overlapping
+    prediction only.
+    """
+    correct = np.zeros((len(pred_classes), len(thresholds)), dtype=bool)
+    if len(pred_classes) == 0 or len(gt_classes) == 0:
+        return correct
+    iou = iou * (gt_classes[:, None] == pred_classes[None, :])
+    for t, threshold in enumerate(thresholds):
+        gt_index, pred_index = np.nonzero(iou >= threshold)
+        if len(gt_index) == 0:
+            continue
+        order = np.argsort(-iou[gt_index, pred_index], kind="stable")
+        gt_index, pred_index = gt_index[order], pred_index[order]
+        _, first = np.unique(pred_index, return_index=True)
+        gt_index, pred_index = gt_index[first], pred_index[first]
+        order = np.argsort(-iou[gt_index, pred_index], kind="stable")
+        gt_index, pred_index = gt_index[order], pred_index[order]
+        _, first = np.unique(gt_index, return_index=True)
+        correct[pred_index[first], t] = True
+    return correct
+
+def confusion_matrix(pred_classes, confidences, gt_classes, iou, num_classes):
+    """(nc + 1) x (nc + 1) counts, rows predicted and columns true class.
+
+    The last row/column is background: missed labels and false detections.
+    """
+    matrix = np.zeros((num_classes + 1, num_classes + 1), dtype=np.int64)
+    confident = confidences >= CONFUSION_CONF
+    pred_classes = pred_classes[confident]
+    iou = iou[:, confident]
+    gt_index, pred_index = np.nonzero(iou > CONFUSION_IOU)
+    if len(gt_index):
+        order = np.argsort(-iou[gt_index, pred_index], kind="stable")
+        gt_index, pred_index = gt_index[order], pred_index[order]
+        _, first = np.unique(pred_index, return_index=True)
+        gt_index, pred_index = gt_index[first], pred_index[first]
+        order = np.argsort(-iou[gt_index, pred_index], kind="stable")
+        gt_index, pred_index = gt_index[order], pred_index[order]
+        _, first = np.unique(gt_index, return_index=True)
+        gt_index, pred_index = gt_index[first], pred_index[first]
+    np.add.at(matrix, (pred_classes[pred_index], gt_classes[gt_index]), 1)
+    missed = np.ones(len(gt_classes), dtype=bool)
+    missed[gt_index] = False
+    np.add.at(matrix, (num_classes, gt_classes[missed]), 1)
+    spurious = np.ones(len(pred_classes), dtype=bool)
+    spurious[pred_index] = False
+    np.add.at(matrix, (pred_classes[spurious], num_classes), 1)
+    return matrix
+
+def evaluate_record(record, labels_dir, names, task="detect"):
+    """Match one image's predictions against its labels"""
+    width, height = record["width"], record["height"]
+    gt_classes, gt_boxes, gt_polygons = read_labels(label_path(record["path"], labels_dir),
+                                                    width, height)
+    pred_classes, confidences, pred_boxes, pred_polygons, unknown = read_predictions(record,
+                                                                                    names)
+    iou = iou_matrix(gt_boxes, pred_boxes)
+    stats = {
+        "box_tp": match_predictions(pred_classes, gt_classes, iou),
+        "confidence": confidences,
+        "pred_class": pred_classes,
+        "gt_class": gt_classes,
+        "confusion": confusion_matrix(pred_classes, confidences, gt_classes, iou, len(names)),
+        "unknown": unknown,
+    }
+    if task == "segment":
+        overlap = mask_iou(rasterize(gt_polygons, width, height),
+                           rasterize(pred_polygons, width, height))
+        stats["mask_tp"] = match_predictions(pred_classes, gt_classes, overlap)
+    return stats
+
+def _reduce(parts):
+    """Concatenate per-image (or per-chunk) stats into one set"""
+    parts = [p for p in parts if p]
+    if not parts:
+        return {}
+    reduced = {key: np.concatenate([p[key] for p in parts])
+               for key in parts[0] if key not in ("confusion", "images", "unknown")}
+    reduced["confusion"] = sum(p["confusion"] for p in parts)
+    reduced["images"] = sum(p.get("images", 1) for p in parts)
+    reduced["unknown"] = sum(p.get("unknown", 0) for p in parts)
+    return reduced
+
+def _evaluate_chunk(lines, labels_dir, names, task):
+    """Process-pool stage: parse and match one chunk of JSONL lines"""
+    parts = []
+    skipped = 0
+    for line in lines:
+        record = json.loads(line)
+        if "error" in record:
+            skipped += 1
+            continue
+        parts.append(evaluate_record(record, labels_dir, names, task))
+    return _reduce(parts), skipped
+
+def ap_per_class(tp, confidences, pred_classes, gt_classes, num_classes):
+    """Per-class precision, recall, F1 and AP at each IoU threshold.
+
+    Precision and recall are taken at the confidence that maximizes the
+    mean F1 over classes, and AP uses 101-point interpolation of the
+    monotone precision envelope, both as in Ultralytics' validator.
+    """
+    order = np.argsort(-confidences, kind="stable")
+    tp, confidences, pred_classes = tp[order], confidences[order], pred_classes[order]
+    gt_counts = np.bincount(gt_classes, minlength=num_classes)[:num_classes]
+    thresholds = tp.shape[1]
+    ap = np.zeros((num_classes, thresholds))
+    grid = np.linspace(0, 1, 1000)
+    precision_curve = np.zeros((num_classes, len(grid)))
+    recall_curve = np.zeros((num_classes, len(grid)))
+    recall_points = np.linspace(0, 1, 101)
+
+    for c in range(num_classes):
+        selected = pred_classes == c
+        n_gt = gt_counts[c]
+        if not selected.any() or n_gt == 0:
+            continue
+        tpc = np.cumsum(tp[selected], axis=0)
+        fpc = np.cumsum(~tp[selected], axis=0)
+        recall = tpc / (n_gt + 1e-16)
+        precision = tpc / (tpc + fpc)
+        conf_c = confidences[selected]
+        # Curves at IoU 0.5 against a descending confidence grid
+        recall_curve[c] = np.interp(-grid, -conf_c, recall[:, 0], left=0)
+        precision_curve[c] = np.interp(-grid, -conf_c, precision[:, 0], left=1)
+
+        # Monotone envelope for all thresholds at once
+        envelope = np.vstack([np.ones((1, thresholds)), precision, np.zeros((1, thresholds))])
+        envelope = np.flip(np.maximum.accumulate(np.flip(envelope, axis=0), axis=0), axis=0)
+        padded_recall = np.vstack([np.zeros((1, thresholds)), recall, np.ones((1, thresholds))])
+        for t in range(thresholds):
+            sampled = np.interp(recall_points, padded_recall[:, t], envelope[:, t])
+            ap[c, t] = np.trapezoid(sampled, recall_points)
+
+    f1 = 2 * precision_curve * recall_curve / (precision_curve + recall_curve + 1e-16)
+    best = int(f1.mean(axis=0).argmax()) if num_classes else 0
+    return {
+        "precision": precision_curve[:, best],
+        "recall": recall_curve[:, best],
+        "f1": f1[:, best],
+        "ap": ap,
+        "gt_counts": gt_counts,
+    }
+
+def summarize(stats, names, task="detect"):
+    """Metrics dict from reduced stats"""
+    summary = {
+        "images": int(stats.get("images", 0)),
+        "classes": {},
+        "confusion_matrix": {
+            "labels": list(names) + ["background"],
+            "matrix": stats["confusion"].tolist() if stats else [],
+        },
+    }
+    if not stats:
+        return summary
+    kinds = ["box"] + (["mask"] if task == "segment" else [])
+    for kind in kinds:
+        result = ap_per_class(stats[f"{kind}_tp"], stats["confidence"], stats["pred_class"],
+                              stats["gt_class"], len(names))
+        present = result["gt_counts"] > 0
+        for c, name in enumerate(names):
+            entry = summary["classes"].setdefault(name, {"labels": int(result["gt_counts"][c])})
+            entry[kind] = {
+                "precision": round(float(result["precision"][c]), 4),
+                "recall": round(float(result["recall"][c]), 4),
+                "mAP50": round(float(result["ap"][c, 0]), 4),
+                "mAP50-95": round(float(result["ap"][c].mean()), 4),
+            }
+        summary[kind] = {
+            "precision": round(float(result["precision"][present].mean()), 4) if present.any() else 0.0,
+            "recall": round(float(result["recall"][present].mean()), 4) if present.any() else 0.0,
+            "mAP50": round(float(result["ap"][present, 0].mean()), 4) if present.any() else 0.0,
+            "mAP50-95": round(float(result["ap"][present].mean()), 4) if present.any() else 0.0,
+        }
+    return summary
+
+def _chunks(lines, size):
+    iterator = iter(lines)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def evaluate(predictions, labels_dir=None, names=CLASS_NAMES, task="detect", workers=None,
+             chunk_size=256):
+    """Score a predict.py JSONL file (path or iterable of lines).
+
+    At most 2 * workers chunks are in flight, so memory depends on the
+    chunk size and not on the size of the dataset.
+    """
+    workers = workers or os.cpu_count() or 1
+    own_file = isinstance(predictions, str)
+    lines = open(predictions) if own_file else predictions
+    parts = []
+    skipped = 0
+    try:
+        chunks = _chunks((line for line in lines if line.strip()), chunk_size)
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            pending = set()
+            for chunk in chunks:
+                pending.add(pool.submit(_evaluate_chunk, chunk, labels_dir, names, task))
+                if len(pending) >= 2 * workers:
+                    finished, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in finished:
+                        part, chunk_skipped = future.result()
+                        parts.append(part)
+                        skipped += chunk_skipped
+            for future in concurrent.futures.as_completed(pending):
+                part, chunk_skipped = future.result()
+                parts.append(part)
+                skipped += chunk_skipped
+    finally:
+        if own_file:
+            lines.close()
+
+    stats = _reduce(parts)
+    summary = summarize(stats, names, task)
+    summary["skipped"] = skipped
+    summary["unknown_detections"] = int(stats.get("unknown", 0))
+    return summary
+
+def format_table(summary):
+    """Plain-text table in the layout of Ultralytics' validation output"""
+    kinds = [kind for kind in ("box", "mask") if kind in summary]
+    header = f"{'Class':>16} {'Labels':>8}"
+    for kind in kinds:
+        header += "".join(f" {kind.capitalize() + '(' + m + ')':>14}"
+                          for m in ("P", "R", "mAP50", "mAP50-95"))
+    rows = [header]
+    total = sum(entry["labels"] for entry in summary["classes"].values())
+    row = f"{'all':>16} {total:>8}"
+    for kind in kinds:
+        row += "".join(f" {summary[kind][m]:>14.3f}"
+                       for m in ("precision", "recall", "mAP50", "mAP50-95"))
+    rows.append(row)
+    for name, entry in summary["classes"].items():
+        row = f"{name:>16} {entry['labels']:>8}"
+        for kind in kinds:
+            row += "".join(f" {entry[kind][m]:>14.3f}"
+                           for m in ("precision", "recall", "mAP50", "mAP50-95"))
+        rows.append(row)
+    return "\n".join(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Score predictions against YOLO labels")
+    parser.add_argument("predictions", help="JSONL written by predict.py ('-' for stdin)")
+    parser.add_argument("--labels", help="directory of label files (default: ../labels next to images)")
+    parser.add_argument("--task", choices=("detect", "segment"), default="detect")
+    parser.add_argument("--names", default=",".join(CLASS_NAMES),
+                        help="comma-separated class names in label-file order")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=256, help="JSONL lines per task")
+    parser.add_argument("--json", help="also write the metrics here")
+    args = parser.parse_args()
+
+    predictions = sys.stdin if args.predictions == "-" else args.predictions
+    summary = evaluate(predictions, args.labels, args.names.split(","), args.task,
+                       args.workers, args.chunk_size)
+    print(format_table(summary))
+    if summary["skipped"]:
+        print(f"{summary['skipped']} images skipped because prediction failed", file=sys.stderr)
+    if summary["unknown_detections"]:
+        print(f"{summary['unknown_detections']} detections ignored because their class is not "
+              f"one of --names", file=sys.stderr)
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Embedded store of field observations.
+
+Every analysed image becomes one row in `images` with its detections in
+`detections`. `daily_counts` holds running per plot/day/class totals that
+are updated in the same transaction as each insert, so trend queries such
+as class_ratio() read a handful of pre-aggregated rows instead of
+rescanning raw detections.
+"""
+import collections
+import datetime
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+from PIL import ExifTags
+
+from detections import Detections
+
+load_dotenv()
+
+OBSERVATIONS_DB = os.getenv("OBSERVATIONS_DB", "observations.db")
+DEFAULT_PLOT = os.getenv("DEFAULT_PLOT", "default")
+# Detections are stored at this confidence, whatever the viewer's slider shows,
+# so trends do not depend on how the slider was set when an image was opened
+OBSERVATION_CONFIDENCE = float(os.getenv("OBSERVATION_CONFIDENCE", "0.25"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL,
+    plot TEXT NOT NULL,
+    day TEXT NOT NULL,
+    captured_at TEXT NOT NULL,
+    latitude REAL,
+    longitude REAL,
+    width INTEGER,
+    height INTEGER,
+    confidence_threshold REAL NOT NULL,
+    name TEXT,
+    recorded_at TEXT NOT NULL,
+    UNIQUE (digest, plot)
+);
+CREATE INDEX IF NOT EXISTS images_plot_day ON images (plot, day);
+CREATE INDEX IF NOT EXISTS images_day ON images (day);
+
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+    class_name TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    area_fraction REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_image ON detections (image_id);
+CREATE INDEX IF NOT EXISTS detections_class ON detections (class_name, image_id);
+
+CREATE TABLE IF NOT EXISTS daily_counts (
+    plot TEXT NOT NULL,
+    day TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    detections INTEGER NOT NULL,
+    confidence_sum REAL NOT NULL,
+    area_sum REAL NOT NULL,
+    PRIMARY KEY (plot, day, class_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_counts_day ON daily_counts (day, class_name);
+
+CREATE TABLE IF NOT EXISTS daily_images (
+    plot TEXT NOT NULL,
+    day TEXT NOT NULL,
+    images INTEGER NOT NULL,
+    PRIMARY KEY (plot, day)
+) WITHOUT ROWID;
+"""
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+def connect(path=None):
+    """Open the store, creating its tables on first use.
+
+    Connections are cheap; open one per thread rather than sharing one.
+    """
+    path = path or OBSERVATIONS_DB
+    connection = sqlite3.connect(path, timeout=10)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    with _schema_lock:
+        if path not in _schema_ready:
+            # WAL lets dashboards read while the app writes
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.executescript(_SCHEMA)
+            _schema_ready.add(path)
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+def _rational(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+def _degrees(dms, ref):
+    """GPS degrees/minutes/seconds rationals to signed decimal degrees"""
+    if not dms or len(dms) != 3:
+        return None
+    parts = [_rational(v) for v in dms]
+    if None in parts:
+        return None
+    value = parts[0] + parts[1] / 60.0 + parts[2] / 3600.0
+    return -value if ref in ("S", "W") else value
+
+def exif_metadata(exif):
+    """(captured_at, latitude, longitude) from a PIL Exif object.
+
+    captured_at is a naive local datetime or None; coordinates are None
+    when the photo has no GPS fix.
+    """
+    if not exif:
+        return None, None, None
+    captured_at = None
+    exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+    for raw in (exif_ifd.get(ExifTags.Base.DateTimeOriginal), exif.get(ExifTags.Base.DateTime)):
+        if raw:
+            try:
+                captured_at = datetime.datetime.strptime(str(raw).strip("\x00 "),
+                                                         "%Y:%m:%d %H:%M:%S")
+                break
+            except ValueError:
+                continue
+
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    latitude = _degrees(gps.get(ExifTags.GPS.GPSLatitude), gps.get(ExifTags.GPS.GPSLatitudeRef))
+    longitude = _degrees(gps.get(ExifTags.GPS.GPSLongitude), gps.get(ExifTags.GPS.GPSLongitudeRef))
+    return captured_at, latitude, longitude
+
+def _summaries(detections):
+    """Per-class (count, confidence sum, area sum) of detection rows"""
+    totals = collections.defaultdict(lambda: [0, 0.0, 0.0])
+    for class_name, confidence, area in detections:
+        total = totals[class_name]
+        total[0] += 1
+        total[1] += confidence
+        total[2] += area
+    return totals
+
+def _apply(connection, plot, day, detections, sign):
+    """Add (sign=1) or subtract (sign=-1) one image from the running aggregates"""
+    connection.executemany(
+        "INSERT INTO daily_counts (plot, day, class_name, detections, confidence_sum, area_sum) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (plot, day, class_name) DO UPDATE SET "
+        "detections = detections + excluded.detections, "
+        "confidence_sum = confidence_sum + excluded.confidence_sum, "
+        "area_sum = area_sum + excluded.area_sum",
+        [(plot, day, class_name, sign * count, sign * confidence, sign * area)
+         for class_name, (count, confidence, area) in _summaries(detections).items()],
+    )
+    connection.execute(
+        "INSERT INTO daily_images (plot, day, images) VALUES (?, ?, ?) "
+        "ON CONFLICT (plot, day) DO UPDATE SET images = images + excluded.images",
+        (plot, day, sign),
+    )
+    if sign < 0:
+        connection.execute("DELETE FROM daily_counts WHERE plot = ? AND day = ? AND detections <= 0",
+                           (plot, day))
+        connection.execute("DELETE FROM daily_images WHERE plot = ? AND day = ? AND images <= 0",
+                           (plot, day))
+
+def _delete(connection, image_id):
+    row = connection.execute("SELECT plot, day FROM images WHERE id = ?", (image_id,)).fetchone()
+    if row is None:
+        return False
+    detections = connection.execute(
+        "SELECT class_name, confidence, area_fraction FROM detections WHERE image_id = ?",
+        (image_id,)).fetchall()
+    _apply(connection, row["plot"], row["day"], [tuple(d) for d in detections], -1)
+    connection.execute("DELETE FROM images WHERE id = ?", (image_id,))
+    return True
+
+def record(digest, results, size, plot=DEFAULT_PLOT, exif=None, full_size=None,
+           confidence_threshold=OBSERVATION_CONFIDENCE, name=None, connection=None):
+    """Store one analysed image and update the aggregates; returns its row id.
+
+    size is the (width, height) the result coordinates refer to, used to
+    turn box areas into fractions of the image. Only detections at or above
+    confidence_threshold are stored. Recording the same image for the same
+    plot again replaces the earlier observation, unless nothing changed.
+    """
+    captured_at, latitude, longitude = exif_metadata(exif)
+    recorded_at = datetime.datetime.now()
+    captured_at = captured_at or recorded_at
+    day = captured_at.date().isoformat()
+    width, height = full_size or size
+    image_area = float(size[0] * size[1]) or 1.0
+
+    kept = Detections.from_results(results).above(confidence_threshold)
+    boxes = kept.boxes.astype(np.float64)
+    areas = np.clip(boxes[:, 2] - boxes[:, 0], 0, None) \
+        * np.clip(boxes[:, 3] - boxes[:, 1], 0, None) / image_area
+    confidence = np.round(kept.confidence.astype(np.float64), 6)
+    detections = list(zip(kept.class_names(), confidence.tolist(), areas.tolist()))
+
+    own_connection = connection is None
+    connection = connection or connect()
+    try:
+        with connection:
+            existing = connection.execute(
+                "SELECT id, confidence_threshold FROM images WHERE digest = ? AND plot = ?",
+                (digest, plot)).fetchone()
+            if existing is not None:
+                if existing["confidence_threshold"] == confidence_threshold:
+                    return existing["id"]
+                _delete(connection, existing["id"])
+
+            image_id = connection.execute(
+                "INSERT INTO images (digest, plot, day, captured_at, latitude, longitude, "
+                "width, height, confidence_threshold, name, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, plot, day, captured_at.isoformat(timespec="seconds"), latitude,
+                 longitude, width, height, confidence_threshold, name,
+                 recorded_at.isoformat(timespec="seconds")),
+            ).lastrowid
+            connection.executemany(
+                "INSERT INTO detections (image_id, class_name, confidence, area_fraction) "
+                "VALUES (?, ?, ?, ?)",
+                [(image_id,) + detection for detection in detections],
+            )
+            _apply(connection, plot, day, detections, 1)
+        return image_id
+    finally:
+        if own_connection:
+            connection.close()
+
+def delete(image_id, connection=None):
+    """Remove one observation and take it out of the aggregates"""
+    own_connection = connection is None
+    connection = connection or connect()
+    try:
+        with connection:
+            return _delete(connection, image_id)
+    finally:
+        if own_connection:
+            connection.close()
+
+def _since(days, until):
+    until = until or datetime.date.today()
+    return (until - datetime.timedelta(days=days - 1)).isoformat(), until.isoformat()
+
+def class_ratio(class_name, days=30, until=None, plots=None, connection=None):
+    """Share of detections that are class_name, per plot, over the last days.
+
+    Reads only the running aggregates, e.g. the diseased lettuce ratio per
+    bed: class_ratio("disease_lettuce", days=30).
+    """
+    start, end = _since(days, until)
+    query = ("SELECT plot, SUM(CASE WHEN class_name = ? THEN detections ELSE 0 END) AS hits, "
+             "SUM(detections) AS total FROM daily_counts WHERE day BETWEEN ? AND ?")
+    args = [class_name, start, end]
+    if plots:
+        query += f" AND plot IN ({', '.join('?' * len(plots))})"
+        args.extend(plots)
+    query += " GROUP BY plot ORDER BY plot"
+
+    own_connection = connection is None
+    connection = connection or connect()
+    try:
+        return {row["plot"]: row["hits"] / row["total"] if row["total"] else 0.0
+                for row in connection.execute(query, args)}
+    finally:
+        if own_connection:
+            connection.close()
+
+def daily_summary(plot=None, days=30, until=None, connection=None):
+    """Per plot/day/class counts, mean confidence and mean box area"""
+    start, end = _since(days, until)
+    query = ("SELECT c.plot, c.day, c.class_name, c.detections, "
+             "c.confidence_sum / c.detections AS mean_confidence, "
+             "c.area_sum / c.detections AS mean_area_fraction, i.images "
+             "FROM daily_counts c JOIN daily_images i ON i.plot = c.plot AND i.day = c.day "
+             "WHERE c.day BETWEEN ? AND ?")
+    args = [start, end]
+    if plot is not None:
+        query += " AND c.plot = ?"
+        args.append(plot)
+    query += " ORDER BY c.plot, c.day, c.class_name"
+
+    own_connection = connection is None
+    connection = connection or connect()
+    try:
+        return [dict(row) for row in connection.execute(query, args)]
+    finally:
+        if own_connection:
+            connection.close()
@@ -1,18 +1,219 @@
-from ultralytics import YOLO
-import streamlit as st
-import cv2
-import numpy as np
+"""Batch prediction over directories or globs of field photos.
 
-best_pt = 'C:/Users/Yuri/Projects/plant_identification/weights/phmv2-1.pt'
+    python predict.py D:/School/SP/plants/V2 --output outputs/results.jsonl \
+        --annotate-dir outputs/annotated --workers 8 --concurrency 16
 
-# weights = 'C:/Users/Yuri/Projects/plant_identification/runs/detect/PHM28/weights/best.pt'
+Images are decoded and downscaled on a process pool, sent to the inference
+backend with at most --concurrency requests in flight, optionally rendered
+on the process pool, and written to the JSONL file as each one finishes.
+"""
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
 
-model = YOLO(best_pt)
-# model = YOLO('yolov8s.pt')
+import api_client
+import backends
+import cache
+import ingest
+import masks
+import process
 
-st.title("PHM")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
 
-path = 'D:/School/SP/plants/V2'
+def find_images(inputs):
+    """Expand directories (recursively) and glob patterns into image paths"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        paths.append(os.path.join(root, name))
+        else:
+            paths.extend(p for p in sorted(glob.glob(item, recursive=True))
+                         if os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS)
+    # Keep the first occurrence of paths matched by several inputs
+    return list(dict.fromkeys(paths))
 
-save_path='../plant_identification/outputs' #This is where your plant images you want to use for testing are found
-results = model(source=path, conf=0.25, save=True, save_dir=save_path)
\ No newline at end of file
+def _decode(path, imgsz):
+    """Process-pool stage: read, orient and downscale one image for upload.
+
+    Only the reduced working copy is decoded; the returned scale maps
+    coordinates on the upload straight onto the full-size original.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    ingested = ingest.IngestedImage(data, max_side=int(imgsz * backends.UPLOAD_MARGIN))
+    payload, (sx, sy) = backends.prepare_upload(ingested.image, imgsz)
+    full_sx, full_sy = ingested.scale
+    width, height = ingested.full_size
+    return {
+        "digest": cache.image_digest(data),
+        "payload": payload,
+        "scale": (sx * full_sx, sy * full_sy),
+        "width": width,
+        "height": height,
+    }
+
+def _infer(backend, decoded, params):
+    """Thread-pool stage: cached prediction for one decoded image"""
+    size = [decoded["width"], decoded["height"]]
+    # Records keep polygons, which metrics.py evaluates, simplified
+    cache_key = cache.make_digest_key(decoded["digest"], **backend.cache_params(), **params,
+                                      masks=masks.cache_params("polygon"), size=size)
+    results = cache.get(cache_key)
+    if results is None:
+        results = backend.predict_payload(decoded["payload"], decoded["scale"], **params)
+        masks.compact_results(results, size, mask_format="polygon")
+        cache.put(cache_key, results)
+    return results
+
+def _render(path, results, mode, confidence_threshold, output_path):
+    """Process-pool stage: draw detections on the full image and save it"""
+    with open(path, "rb") as f:
+        img = ingest.decode(f.read())[0]
+    if mode == "segment":
+        annotated, _ = process.draw_segments(img, results, confidence_threshold)
+    else:
+        annotated, _ = process.draw_boxes(img, results, confidence_threshold)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    annotated.save(output_path, quality=90)
+    return output_path
+
+def _record(path, decoded, results, confidence_threshold):
+    detections = [d for d in results["images"][0]["results"]
+                  if d.get("confidence", 0.0) >= confidence_threshold]
+    counts = {}
+    for detection in detections:
+        name = detection.get("name", "Unknown")
+        counts[name] = counts.get(name, 0) + 1
+    return {
+        "path": path,
+        "width": decoded["width"],
+        "height": decoded["height"],
+        "counts": counts,
+        "results": detections,
+    }
+
+def _annotated_path(path, annotate_dir, roots):
+    """Mirror the input layout under annotate_dir"""
+    for root in roots:
+        if os.path.isdir(root) and os.path.commonpath([os.path.abspath(root), os.path.abspath(path)]) == os.path.abspath(root):
+            return os.path.join(annotate_dir, os.path.relpath(path, root))
+    return os.path.join(annotate_dir, os.path.basename(path))
+
+def run_batch(paths, output, backend, mode="box", confidence_threshold=0.25,
+              workers=None, concurrency=8, annotate_dir=None, roots=(), log=sys.stderr):
+    """Run the decode -> infer -> render pipeline and stream JSONL records.
+
+    At most concurrency + 2 * workers images are in flight at any stage so
+    memory stays bounded regardless of how many paths are given.
+    """
+    workers = workers or os.cpu_count() or 1
+    params = {
+        "imgsz": process.IMGSZ,
+        "conf": confidence_threshold,
+        "iou": process.IOU,
+        "retina_masks": mode == "segment",
+    }
+    max_in_flight = concurrency + 2 * workers
+    pending = {}
+    path_iter = iter(paths)
+    done = failed = 0
+    start = time.perf_counter()
+
+    def submit_decode():
+        path = next(path_iter, None)
+        if path is not None:
+            pending[cpu_pool.submit(_decode, path, params["imgsz"])] = ("decode", path, None)
+
+    def finish(record):
+        nonlocal done, failed
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        done += 1
+        failed += "error" in record
+        if log is not None:
+            rate = done / (time.perf_counter() - start)
+            print(f"[{done}/{len(paths)}] {record['path']} ({rate:.1f} img/s)", file=log)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as cpu_pool, \
+            concurrent.futures.ThreadPoolExecutor(concurrency) as io_pool:
+        for _ in range(max_in_flight):
+            submit_decode()
+
+        while pending:
+            finished, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                stage, path, context = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    finish({"path": path, "stage": stage, "error": str(e)})
+                    submit_decode()
+                    continue
+
+                if stage == "decode":
+                    pending[io_pool.submit(_infer, backend, value, params)] = ("infer", path, value)
+                elif stage == "infer":
+                    record = _record(path, context, value, confidence_threshold)
+                    if annotate_dir:
+                        output_path = _annotated_path(path, annotate_dir, roots)
+                        future = cpu_pool.submit(_render, path, value, mode,
+                                                 confidence_threshold, output_path)
+                        pending[future] = ("render", path, record)
+                    else:
+                        finish(record)
+                        submit_decode()
+                else:
+                    context["annotated"] = value
+                    finish(context)
+                    submit_decode()
+
+    return done, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch lettuce health prediction")
+    parser.add_argument("inputs", nargs="+", help="image directories, files or glob patterns")
+    parser.add_argument("-o", "--output", default="-",
+                        help="JSONL file to stream results to (default: stdout)")
+    parser.add_argument("--annotate-dir", help="save annotated images here")
+    parser.add_argument("--mode", choices=("box", "segment"), default="box")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default=backends.BACKEND)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes for decoding and rendering")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum inference requests in flight")
+    args = parser.parse_args()
+
+    paths = find_images(args.inputs)
+    if not paths:
+        parser.error("no images found")
+
+    # Let every in-flight request keep its own pooled connection
+    api_client.POOL_SIZE = max(api_client.POOL_SIZE, args.concurrency)
+    backend = backends.get_backend(args.backend)
+
+    start = time.perf_counter()
+    if args.output == "-":
+        done, failed = run_batch(paths, sys.stdout, backend, args.mode, args.conf,
+                                 args.workers, args.concurrency, args.annotate_dir, args.inputs)
+    else:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as output:
+            done, failed = run_batch(paths, output, backend, args.mode, args.conf,
+                                     args.workers, args.concurrency, args.annotate_dir,
+                                     args.inputs)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {done} images ({failed} failed) in {elapsed:.1f}s "
+          f"({done / elapsed:.1f} img/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
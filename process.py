@@ -1,55 +1,110 @@
+import io
 import os
 from dotenv import load_dotenv
 import streamlit as st
-import requests
-from PIL import Image, ImageDraw, ImageFont, ExifTags
+import backends
+import cache
+from detections import Detections
+import ingest
+import masks
+import render
+import telemetry
+import tiling
+from PIL import Image, ImageFont
 
 load_dotenv()
 
-MODEL = os.getenv("MODEL")
-KEY = os.getenv("YOLO_KEY")
-
-# LETTUCE_MODEL = os.getenv("LETTUCE_MODEL")
-# WEED_MODEL = os.getenv("WEED_MODEL")
-# KEY = os.getenv("YOLO_KEY")
-
-
-# Color schemes for health status
-CLASS_COLORS = {
-    "normal_lettuce": "blue",
-    "disease_lettuce": "red",
-    "weed": "yellow"
-}
-
-BGR_COLORS = {
-    "blue": (255, 0, 0),
-    "red": (0, 0, 255),
-    "yellow": (0, 255, 255),
-}
-
-def _make_api_request(image_path, confidence_threshold, retina_masks=False):
-    """Common API request function for both models"""
-    url = "https://predict.ultralytics.com"
-    headers = {"x-api-key": KEY}
-    data = {
-        "model": MODEL,
-        "imgsz": 640,
+# Model input size and NMS IoU threshold sent with every request
+IMGSZ = 640
+IOU = 0.45
+
+# Detections are fetched once at this floor and re-thresholded locally
+CONF_FLOOR = float(os.getenv("CONF_FLOOR", "0.05"))
+
+# Longest side and JPEG quality of the images sent to the browser
+DISPLAY_MAX_SIDE = int(os.getenv("DISPLAY_MAX_SIDE", "1000"))
+DISPLAY_QUALITY = int(os.getenv("DISPLAY_QUALITY", "85"))
+
+# Separate lettuce and weed models: list both in MODELS (see backends.py)
+
+
+def request_results(img, image_bytes, confidence_threshold, retina_masks=False, tiled=False,
+                    backend=None, use_cache=True):
+    """Cached inference for all backends; raises backends.BackendError.
+
+    img is the decoded RGB image to analyse; image_bytes are the encoded
+    bytes it came from and only serve as the cache address. With tiled,
+    the full-resolution original is decoded from image_bytes and analysed
+    tile by tile, and the merged results are scaled onto img. Returns
+    Detections; the cache and the backends keep the API response schema.
+    backend defaults to the configured one; use_cache=False always runs
+    inference, as benchmarks do. Safe to call from worker threads.
+    """
+    params = {
+        "imgsz": IMGSZ,
         "conf": confidence_threshold,
-        "iou": 0.45
+        "iou": IOU,
+        "retina_masks": retina_masks
     }
-    
-    if retina_masks:
-        data["retina_masks"] = True
-    
+
+    backend = backend or backends.get_backend()
+    if use_cache:
+        # Results are in pixels of img, which may be a reduced working copy
+        tiling_params = {"tiling": tiling.cache_params()} if tiled else {}
+        cache_key = cache.make_key(image_bytes, **backend.cache_params(), **params,
+                                   **tiling_params, masks=masks.cache_params(),
+                                   size=list(img.size))
+        results = cache.get(cache_key)
+        if results is not None:
+            return Detections.from_results(results)
+
+    if tiled:
+        full = ingest.decode(image_bytes)[0]
+        results = tiling.predict_tiled(full, backend, **params)
+        scale = (img.width / full.width, img.height / full.height)
+        # The full-resolution pixels are not needed once the tiles are analysed
+        del full
+        results = backends.scale_results(results, scale)
+    else:
+        results = backend.predict(img, **params)
+    # Full-resolution polygons are reduced once, before caching
+    masks.compact_results(results, img.size)
+    if use_cache:
+        cache.put(cache_key, results)
+    return Detections.from_results(results)
+
+def _make_api_request(img, image_bytes, confidence_threshold, retina_masks=False, tiled=False):
+    """Common inference request function for all backends; reports errors in the page"""
     try:
-        with open(image_path, "rb") as f:
-            response = requests.post(url, headers=headers, data=data, files={"file": f})
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"API request failed: {e}")
+        return request_results(img, image_bytes, confidence_threshold, retina_masks, tiled)
+    except backends.BackendError as e:
+        st.error(str(e))
         return None
     
+def fetch_results(img, image_bytes, tiled=False):
+    """Fetch boxes and segments once at CONF_FLOOR for local re-thresholding"""
+    return _make_api_request(img, image_bytes, CONF_FLOOR, retina_masks=True, tiled=tiled)
+
+def working_max_side():
+    """Longest side of the decoded working copy: the preview, or the upload if larger"""
+    return max(ingest.PREVIEW_MAX_SIDE, int(IMGSZ * backends.UPLOAD_MARGIN))
+
+def display_jpeg(img):
+    """Encode an image for st.image at display size.
+
+    Given a PIL image, Streamlit encodes it as a quality-100 JPEG and
+    decodes and re-encodes it again when it is wider than the page; bytes
+    that already fit are sent as they are.
+    """
+    with telemetry.span("display_encode"):
+        if max(img.size) > DISPLAY_MAX_SIDE:
+            img = img.copy()
+            img.thumbnail((DISPLAY_MAX_SIDE, DISPLAY_MAX_SIDE), Image.Resampling.BILINEAR,
+                          reducing_gap=2.0)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=DISPLAY_QUALITY)
+    return buffer.getvalue()
+
 def _display_legend(legend_items):
     """Helper function to display the color legend"""
     st.sidebar.subheader("Color Legend")
@@ -68,84 +123,60 @@ def _setup_font(img_width, img_height):
     base_font_size = int(min(img_width, img_height) * 0.02)
     base_font_size = max(6, min(base_font_size, 16))
     
-    try:
-        if os.name == 'nt':  # Windows
-            font = ImageFont.truetype("arial.ttf", base_font_size)
-        else:  # Linux/Mac
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", base_font_size)
-    except IOError:
+    font = render.load_font(base_font_size)
+    if font is None:
         font = ImageFont.load_default()
         st.warning("Using default font as system font not found")
     
     return font
 
-def _process_image_common(image_path):
-    # Check 1: Verify file exists
-    if not os.path.exists(image_path):
-        st.error(f"Image file not found: {image_path}")
+def _process_image_common(img):
+    if img is None:
+        st.error("No image to process")
         return None
 
     try:
-        # Check 2: Verify image can be opened and is in correct format
-        img = Image.open(image_path)
+        # Verify image is in correct format
         if img.mode != 'RGB':
             img = img.convert('RGB')
-            img.save(image_path)
         return img
     except Exception as e:
         st.error(f"Error reading image: {e}")
         return None
 
-def process_static_image_box(image_path):
+def draw_boxes(img, results, confidence_threshold):
+    """Draw bounding boxes above the threshold; returns (image, legend_items)"""
+    with telemetry.span("render", mode="box"):
+        return render.render_boxes(img, results, confidence_threshold)
+
+def draw_segments(img, results, confidence_threshold):
+    """Fill segmentation masks above the threshold; returns (image, legend_items)"""
+    with telemetry.span("render", mode="segment"):
+        return render.render_segments(img, results, confidence_threshold)
+
+def process_static_image_box(img, image_bytes, results=None):
     """Process a static image with bounding boxes for both lettuce and weed detection"""
     try:
         confidence_threshold = st.session_state.get('confidence_threshold', 0.25)
 
-        img = _process_image_common(image_path)
+        img = _process_image_common(img)
         if img is None:
             return
         
-        results = _make_api_request(image_path, confidence_threshold)
+        if results is None:
+            results = fetch_results(img, image_bytes)
         if results is None:
             return
 
-        predicted_image = Image.open(image_path)
-        draw = ImageDraw.Draw(predicted_image)
-        
-        img_width, img_height = predicted_image.size
-        font = _setup_font(img_width, img_height)
-        line_thickness = max(1, min(int(min(img_width, img_height) * 0.003), 8))
-        
-        legend_items = {}
-
-        for detection in results["images"][0]["results"]:
-            class_name = detection.get("name", "Unknown")
-            confidence = detection.get("confidence", 0.0)
-            box = detection.get("box", {})
-            
-            x1 = float(box.get("x1", 0))
-            y1 = float(box.get("y1", 0))
-            x2 = float(box.get("x2", 0))
-            y2 = float(box.get("y2", 0))
-            
-            x1, x2 = max(0, min(x1, img_width)), max(0, min(x2, img_width))
-            y1, y2 = max(0, min(y1, img_height)), max(0, min(y2, img_height))
-
-            color_name = CLASS_COLORS.get(class_name)
-            base_color = BGR_COLORS.get(color_name, (0, 255, 0))
-            rgb_color = (base_color[2], base_color[1], base_color[0])
-            
-            for i in range(line_thickness):
-                draw.rectangle(
-                    [(x1+i, y1+i), (x2-i, y2-i)],
-                    outline=rgb_color
-                )
-            
-            if class_name not in legend_items:
-                legend_items[class_name] = rgb_color
+        predicted_image, legend_items = draw_boxes(img, results, confidence_threshold)
+        # Only the display-sized JPEG outlives this call
+        display = display_jpeg(predicted_image)
+        del predicted_image
         
         _display_legend(legend_items)
-        st.image(predicted_image, caption="Processed Image with Detections", use_container_width=True)
+        with telemetry.span("st_image"):
+            st.image(display, caption="Processed Image with Detections", use_container_width=True,
+                     output_format="JPEG")
         
         return results
 
@@ -153,54 +184,31 @@ def process_static_image_box(image_path):
         st.error(f"Unexpected error: {e}")
         return None
     
-def process_static_image_segment(image_path):
+def process_static_image_segment(img, image_bytes, results=None):
     """Process a static image with segmentation for both lettuce and weed detection"""
     try:
         confidence_threshold = st.session_state.get('confidence_threshold', 0.25)
         
-        img = _process_image_common(image_path)
+        img = _process_image_common(img)
         if img is None:
             return
         
-        results = _make_api_request(image_path, confidence_threshold, retina_masks=True)
+        if results is None:
+            results = fetch_results(img, image_bytes)
         if results is None:
             return
 
-        predicted_image = Image.open(image_path)
-        draw = ImageDraw.Draw(predicted_image, 'RGBA')
-        
-        img_width, img_height = predicted_image.size
-        legend_items = {}
-        
-        for detection in results["images"][0]["results"]:
-            confidence = detection.get("confidence", 0.0)
-            
-            if confidence >= confidence_threshold:
-                class_name = detection.get("name", "Unknown")
-                segments = detection.get("segments", {})
-                
-                color_name = CLASS_COLORS.get(class_name)
-                base_color = BGR_COLORS.get(color_name, (0, 255, 0))
-                mask_color = (base_color[2], base_color[1], base_color[0], 127)
-                
-                if segments and "x" in segments and "y" in segments:
-                    x_coords = segments["x"]
-                    y_coords = segments["y"]
-                    points = list(zip(x_coords, y_coords))
-                    points = [(min(max(x, 0), img_width), min(max(y, 0), img_height)) 
-                             for x, y in points]
-                    
-                    if len(points) > 2:
-                        draw.polygon(points, fill=mask_color)
-                
-                if class_name not in legend_items:
-                    legend_items[class_name] = (base_color[2], base_color[1], base_color[0])
+        predicted_image, legend_items = draw_segments(img, results, confidence_threshold)
+        display = display_jpeg(predicted_image)
+        del predicted_image
         
         _display_legend(legend_items)
-        st.image(predicted_image, caption="Processed Image with Segmentation", use_container_width=True)
+        with telemetry.span("st_image"):
+            st.image(display, caption="Processed Image with Segmentation", use_container_width=True,
+                     output_format="JPEG")
         
         return results
 
     except Exception as e:
         st.error(f"Unexpected error: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,118 @@
+import functools
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from detections import Detections
+
+# Color schemes for health status
+CLASS_COLORS = {
+    "normal_lettuce": "blue",
+    "disease_lettuce": "red",
+    "weed": "yellow"
+}
+
+BGR_COLORS = {
+    "blue": (255, 0, 0),
+    "red": (0, 0, 255),
+    "yellow": (0, 255, 255),
+}
+
+# Fallback for classes without an entry in CLASS_COLORS
+DEFAULT_BGR = (0, 255, 0)
+
+# Opacity of segmentation masks
+MASK_ALPHA = 127
+
+def class_rgb(class_name):
+    """RGB color a class is drawn with"""
+    base_color = BGR_COLORS.get(CLASS_COLORS.get(class_name), DEFAULT_BGR)
+    return (base_color[2], base_color[1], base_color[0])
+
+@functools.lru_cache(maxsize=32)
+def load_font(size):
+    """Load the system TrueType font once per size; None if unavailable"""
+    try:
+        if os.name == 'nt':  # Windows
+            return ImageFont.truetype("arial.ttf", size)
+        return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", size)
+    except IOError:
+        return None
+
+def line_thickness(img_width, img_height):
+    return max(1, min(int(min(img_width, img_height) * 0.003), 8))
+
+def _legend(detections):
+    """Class colors in order of first appearance"""
+    if len(detections) == 0:
+        return {}
+    _, first = np.unique(detections.label, return_index=True)
+    names = [detections.names[detections.label[i]] for i in sorted(first)]
+    return {name: class_rgb(name) for name in names}
+
+def render_boxes(img, results, confidence_threshold):
+    """Draw box outlines for detections above the threshold.
+
+    results may be Detections or the API response dict. Coordinates are
+    clamped and truncated in bulk with NumPy, then every box is a single
+    Pillow call with an inward outline width, which gives the same pixels
+    as line_thickness nested one-pixel rectangles.
+    Returns (image, legend_items).
+    """
+    detections = Detections.from_results(results).above(confidence_threshold)
+    predicted_image = img.convert("RGB") if img.mode != "RGB" else img.copy()
+    img_width, img_height = predicted_image.size
+    thickness = line_thickness(img_width, img_height)
+
+    if len(detections):
+        boxes = detections.boxes.astype(np.float64)
+        np.clip(boxes[:, 0::2], 0, img_width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, img_height, out=boxes[:, 1::2])
+        boxes = boxes.astype(np.int64)
+        # Degenerate boxes after clamping would make Pillow raise
+        valid = (boxes[:, 2] >= boxes[:, 0]) & (boxes[:, 3] >= boxes[:, 1])
+
+        colors = [class_rgb(name) for name in detections.names]
+        draw = ImageDraw.Draw(predicted_image)
+        for label, box in zip(detections.label[valid].tolist(), boxes[valid].tolist()):
+            draw.rectangle(box, outline=colors[label], width=thickness)
+
+    return predicted_image, _legend(detections)
+
+def render_segments(img, results, confidence_threshold, alpha=MASK_ALPHA):
+    """Fill masks with a translucent class color, in detection order.
+
+    results may be Detections or the API response dict. Polygons are
+    clamped in bulk with NumPy and each is one translucent Pillow fill;
+    run-length masks are already rasterized and are blended through the
+    same alpha. Overlaps are blended once per mask, in detection order,
+    exactly as drawing every polygon with an RGBA fill; a single label
+    layer composited once was no faster and lost those overlaps.
+    Returns (image, legend_items).
+    """
+    detections = Detections.from_results(results).above(confidence_threshold)
+    predicted_image = img.convert("RGB") if img.mode != "RGB" else img.copy()
+    img_width, img_height = predicted_image.size
+
+    drawable = detections.polygon_lengths > 2
+    pasted = np.diff(detections.rle_offsets) > 0
+    order = np.flatnonzero(drawable | pasted)
+    if len(order):
+        colors = [class_rgb(name) for name in detections.names]
+        points = detections.polygon_points.astype(np.float64)
+        np.clip(points[:, 0], 0, img_width, out=points[:, 0])
+        np.clip(points[:, 1], 0, img_height, out=points[:, 1])
+        offsets = detections.polygon_offsets.tolist()
+
+        draw = ImageDraw.Draw(predicted_image, "RGBA")
+        for i, label in zip(order.tolist(), detections.label[order].tolist()):
+            if pasted[i]:
+                x, y, mask = detections.mask(i)
+                predicted_image.paste(colors[label], (x, y),
+                                      Image.fromarray(mask.astype(np.uint8) * alpha))
+            else:
+                draw.polygon(points[offsets[i]:offsets[i + 1]].ravel().tolist(),
+                             fill=colors[label] + (alpha,))
+
+    return predicted_image, _legend(detections)
@@ -0,0 +1,292 @@
+"""Self-hosted prediction API with dynamic micro-batching.
+
+Serves the predict.ultralytics.com request and response schema from one
+in-process CPU model, so app replicas, predict.py and video.py can share
+it by pointing API_URL at it:
+
+    python server.py --weights PHMv25/weights/best.pt --port 8000
+    API_URL=http://127.0.0.1:8000 streamlit run app.py
+
+Request threads only parse and decode uploads. A single batching thread
+takes the oldest waiting request, collects whatever else arrives within
+BATCH_WAIT_MS (up to BATCH_MAX images) and runs them through the model as
+one batch; requests with different imgsz/conf/iou/retina_masks run as
+separate batches. While a batch runs, new requests queue up and form the
+next one, so batches grow with load. GET /metrics reports batch-size and
+queue-depth histograms in Prometheus text format, plus the pipeline
+telemetry when TELEMETRY=1.
+"""
+import argparse
+import bisect
+import concurrent.futures
+import io
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+from PIL import Image
+
+import backends
+import telemetry
+from form_data import parse_multipart
+
+load_dotenv()
+
+SERVER_WEIGHTS = os.getenv("SERVER_WEIGHTS", backends.LOCAL_WEIGHTS)
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Required x-api-key value; unset accepts any key
+SERVER_API_KEY = os.getenv("SERVER_API_KEY")
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "10"))
+BATCH_MAX = int(os.getenv("BATCH_MAX", "16"))
+# Requests waiting beyond this are answered 503, which clients retry
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "256"))
+# Seconds a request may wait for its batch before giving up
+SERVER_TIMEOUT = float(os.getenv("SERVER_TIMEOUT", "60"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class CountHistogram:
+    """Histogram of small integer values with fixed upper bounds"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def prometheus(self, name):
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, bucket in zip(self.bounds + (float("inf"),), self.buckets):
+            cumulative += bucket
+            le = "+Inf" if bound == float("inf") else str(bound)
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.total}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+class _Request:
+    __slots__ = ("image", "params", "arrived", "future")
+
+    def __init__(self, image, params):
+        self.image = image
+        self.params = params
+        self.arrived = time.perf_counter()
+        self.future = concurrent.futures.Future()
+
+class MicroBatcher:
+    """Groups concurrent predictions into batches for one model"""
+
+    def __init__(self, backend, wait_ms=BATCH_WAIT_MS, max_batch=BATCH_MAX,
+                 max_queue=SERVER_MAX_QUEUE):
+        self.backend = backend
+        self.wait = wait_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self.batch_sizes = CountHistogram(BATCH_SIZE_BUCKETS)
+        self.queue_depths = CountHistogram(QUEUE_DEPTH_BUCKETS)
+        self.batches = 0
+        self.images = 0
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, imgsz, conf, iou, retina_masks=False):
+        """Queue one RGB image; returns a Future of its response schema.
+
+        Raises queue.Full when SERVER_MAX_QUEUE requests are already waiting.
+        """
+        request = _Request(image, (imgsz, conf, iou, retina_masks))
+        self._queue.put_nowait(request)
+        return request.future
+
+    def _collect(self):
+        """Block for the oldest request, then take what arrives within its window"""
+        batch = [self._queue.get()]
+        deadline = batch[0].arrived + self.wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self._lock:
+                self.queue_depths.add(self._queue.qsize())
+            groups = {}
+            for request in batch:
+                groups.setdefault(request.params, []).append(request)
+            for (imgsz, conf, iou, retina_masks), requests in groups.items():
+                self._predict(requests, imgsz, conf, iou, retina_masks)
+
+    def _predict(self, requests, imgsz, conf, iou, retina_masks):
+        started = time.perf_counter()
+        for request in requests:
+            telemetry.observe("queue_wait", started - request.arrived)
+        try:
+            with telemetry.span("batch_inference", size=len(requests)):
+                results = self.backend.predict_batch([r.image for r in requests],
+                                                     imgsz, conf, iou, retina_masks)
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        with self._lock:
+            self.batch_sizes.add(len(requests))
+            self.batches += 1
+            self.images += len(requests)
+        for request, result in zip(requests, results):
+            request.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "images": self.images,
+                "mean_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+            }
+
+    def prometheus_text(self):
+        with self._lock:
+            lines = self.batch_sizes.prometheus("plant_health_server_batch_size")
+            lines += self.queue_depths.prometheus("plant_health_server_queue_depth")
+            lines.append("# TYPE plant_health_server_queue_length gauge")
+            lines.append(f"plant_health_server_queue_length {self._queue.qsize()}")
+        return "\n".join(lines) + "\n"
+
+class PredictHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode("utf-8"), headers=headers)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        batcher = self.server.batcher
+        if path == "/metrics":
+            text = batcher.prometheus_text()
+            if telemetry.ENABLED:
+                text += telemetry.prometheus_text()
+            self._send(200, text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/health":
+            self._send_json(200, {"status": "ok", "model": self.server.model_name,
+                                  **batcher.stats()})
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if SERVER_API_KEY and self.headers.get("x-api-key") != SERVER_API_KEY:
+            self._send_json(401, {"message": "Invalid API key"})
+            return
+
+        start = time.perf_counter()
+        try:
+            fields, files = parse_multipart(self.headers.get("Content-Type", ""), body)
+            with Image.open(io.BytesIO(files["file"])) as img:
+                image = img.convert("RGB")
+            imgsz = int(fields.get("imgsz", 640))
+            conf = float(fields.get("conf", 0.25))
+            iou = float(fields.get("iou", 0.7))
+            retina_masks = fields.get("retina_masks", "").lower() == "true"
+        except Exception as e:
+            self._send_json(400, {"message": f"Invalid request: {e}"})
+            return
+
+        try:
+            future = self.server.batcher.submit(image, imgsz, conf, iou, retina_masks)
+        except queue.Full:
+            self._send_json(503, {"message": "Server busy"}, {"Retry-After": "1"})
+            return
+        try:
+            results = future.result(SERVER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            self._send_json(503, {"message": "Timed out waiting for inference"},
+                            {"Retry-After": "1"})
+            return
+        except Exception as e:
+            self._send_json(500, {"message": f"Inference failed: {e}"})
+            return
+
+        image_results = results["images"][0]
+        image_results["speed"] = {**(image_results.get("speed") or {}),
+                                  "total": 1000 * (time.perf_counter() - start)}
+        self._send_json(200, {
+            "images": [image_results],
+            "metadata": {
+                "imageCount": 1,
+                "model": fields.get("model") or self.server.model_name,
+                "version": {"server": "plant_health"},
+            },
+        })
+
+def start(backend, host="0.0.0.0", port=SERVER_PORT, wait_ms=BATCH_WAIT_MS,
+          max_batch=BATCH_MAX, max_queue=SERVER_MAX_QUEUE, model_name="", verbose=False):
+    """Serve predictions on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), PredictHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(backend, wait_ms, max_batch, max_queue)
+    server.model_name = model_name
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, name="predict-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched local prediction API")
+    parser.add_argument("--weights", default=SERVER_WEIGHTS)
+    parser.add_argument("--device", default=backends.LOCAL_DEVICE)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--wait-ms", type=float, default=BATCH_WAIT_MS,
+                        help="how long the oldest request waits for others to join its batch")
+    parser.add_argument("--max-batch", type=int, default=BATCH_MAX)
+    parser.add_argument("--max-queue", type=int, default=SERVER_MAX_QUEUE)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    backend = backends.LocalYOLOBackend(args.weights, args.device)
+    try:
+        # Load the weights now rather than on the first request
+        backends.load_yolo(args.weights, args.device)
+    except backends.BackendError as e:
+        parser.exit(2, f"{e}\n")
+    server, url = start(backend, args.host, args.port, args.wait_ms, args.max_batch,
+                        args.max_queue, os.path.basename(args.weights), args.verbose)
+    print(f"Prediction API listening on {url} (batches of up to {args.max_batch}, "
+          f"{args.wait_ms:g} ms window)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
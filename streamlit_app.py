@@ -1,12 +1,12 @@
-from ultralytics import YOLO
 import streamlit as st
+import backends
 import cv2
 import numpy as np
 from PIL import Image
 
 # Load YOLOv8 model
 best_pt = 'weights/phmv2-1.pt'
-model = YOLO(best_pt)
+model, model_lock = backends.load_yolo(best_pt)
 
 st.title("Plant Identification - PHM")
 
@@ -19,7 +19,8 @@ if uploaded_file is not None:
     image = np.array(image)
     
     # Perform inference
-    results = model(image, conf=0.25)
+    with model_lock:
+        results = model(image, conf=0.25)
 
     # Display uploaded image
     st.image(image, caption="Uploaded Image", use_column_width=True)
@@ -0,0 +1,150 @@
+"""Local stand-in for the predict.ultralytics.com endpoint.
+
+Answers multipart POSTs with the same response schema as the hosted API so
+the client, cache and benchmark code can run without network access:
+
+    python stub_api.py --port 8765 --latency 0.2
+    API_URL=http://127.0.0.1:8765 streamlit run app.py
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from form_data import parse_multipart
+
+CLASS_NAMES = ["normal_lettuce", "disease_lettuce", "weed"]
+
+def fake_detections(image_bytes, width, height, count, conf, segments):
+    """Deterministic detections for an image, seeded from its bytes"""
+    rng = random.Random(hashlib.sha1(image_bytes).digest())
+    results = []
+    for _ in range(count):
+        class_id = rng.randrange(len(CLASS_NAMES))
+        confidence = round(rng.uniform(0.05, 0.99), 5)
+        w = rng.uniform(0.05, 0.3) * width
+        h = rng.uniform(0.05, 0.3) * height
+        x1 = rng.uniform(0, width - w)
+        y1 = rng.uniform(0, height - h)
+        if confidence < conf:
+            continue
+        detection = {
+            "class": class_id,
+            "name": CLASS_NAMES[class_id],
+            "confidence": confidence,
+            "box": {"x1": x1, "y1": y1, "x2": x1 + w, "y2": y1 + h},
+        }
+        if segments:
+            cx, cy = x1 + w / 2, y1 + h / 2
+            angles = [2 * math.pi * i / 32 for i in range(32)]
+            detection["segments"] = {
+                "x": [cx + 0.5 * w * math.cos(a) for a in angles],
+                "y": [cy + 0.5 * h * math.sin(a) for a in angles],
+            }
+        results.append(detection)
+    return results
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        with server.lock:
+            server.request_count += 1
+            fail = server.request_count <= server.fail_first
+        if fail:
+            self._send_json(503, {"message": "Service unavailable"},
+                            {"Retry-After": str(server.retry_after)})
+            return
+
+        start = time.perf_counter()
+        try:
+            fields, files = parse_multipart(self.headers.get("Content-Type", ""), body)
+            image_bytes = files["file"]
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                width, height = img.size
+        except Exception as e:
+            self._send_json(400, {"message": f"Invalid request: {e}"})
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        conf = float(fields.get("conf", 0.25))
+        retina_masks = fields.get("retina_masks", "").lower() == "true"
+        results = fake_detections(image_bytes, width, height, server.detections,
+                                  conf, retina_masks)
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        self._send_json(200, {
+            "images": [{
+                "results": results,
+                "shape": [height, width],
+                "speed": {"preprocess": 0.0, "inference": elapsed_ms, "postprocess": 0.0},
+            }],
+            "metadata": {
+                "imageCount": 1,
+                "model": fields.get("model", ""),
+                "version": {"ultralytics": "stub"},
+            },
+        })
+
+def start(host="127.0.0.1", port=0, latency=0.0, detections=20, fail_first=0,
+          retry_after=0, verbose=False):
+    """Serve the stub on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.detections = detections
+    server.fail_first = fail_first
+    server.retry_after = retry_after
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.request_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the prediction API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds of injected inference latency per request")
+    parser.add_argument("--detections", type=int, default=20)
+    parser.add_argument("--fail-first", type=int, default=0,
+                        help="answer the first N requests with 503")
+    parser.add_argument("--retry-after", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url = start(args.host, args.port, args.latency, args.detections,
+                        args.fail_first, args.retry_after, verbose=True)
+    print(f"Stub prediction API listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Stage timings and counters for the processing pipeline.
+
+    with telemetry.span("render"):
+        ...
+    telemetry.count("upload_bytes", len(payload))
+
+Set TELEMETRY=1 to record. When disabled, span() hands back one shared
+no-op context manager and count() returns immediately, so instrumented
+code pays a flag check and nothing else. Recorded data is shown in the
+app's debug panel, exposed in Prometheus text format (TELEMETRY_PORT
+serves /metrics) and optionally written as one JSON line per span to
+TELEMETRY_LOG ("-" for stderr).
+"""
+import bisect
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENABLED = os.getenv("TELEMETRY", "0") == "1"
+TELEMETRY_PORT = int(os.getenv("TELEMETRY_PORT", "0"))
+TELEMETRY_LOG = os.getenv("TELEMETRY_LOG")
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recent samples kept per stage for percentiles in the debug panel
+WINDOW = 512
+
+_PREFIX = "plant_health"
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = collections.Counter()
+_gauges = {}
+_server = None
+
+_logger = logging.getLogger("plant_health.telemetry")
+if TELEMETRY_LOG:
+    _handler = logging.StreamHandler(sys.stderr) if TELEMETRY_LOG == "-" \
+        else logging.FileHandler(TELEMETRY_LOG)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(_handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+
+class _Histogram:
+    __slots__ = ("buckets", "total", "count", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=WINDOW)
+
+class _Span:
+    __slots__ = ("name", "attributes", "start")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        observe(self.name, time.perf_counter() - self.start, **self.attributes)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+_NULL_SPAN = _NullSpan()
+
+def span(name, **attributes):
+    """Context manager timing one pipeline stage"""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, attributes)
+
+def observe(name, seconds, **attributes):
+    """Record a duration measured elsewhere, e.g. reported by the server"""
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram.total += seconds
+        histogram.count += 1
+        histogram.recent.append(seconds)
+    if TELEMETRY_LOG:
+        _logger.info(json.dumps({"ts": round(time.time(), 3), "span": name,
+                                 "ms": round(seconds * 1000.0, 3), **attributes}, default=str))
+
+def count(name, amount=1):
+    """Increase an event counter"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] += amount
+
+def register_gauges(prefix, collect):
+    """Export the numeric values of collect() as gauges named prefix_<key>"""
+    with _lock:
+        _gauges[prefix] = collect
+
+def _gauge_values():
+    with _lock:
+        collectors = list(_gauges.items())
+    values = {}
+    for prefix, collect in collectors:
+        for key, value in collect().items():
+            if isinstance(value, (int, float)):
+                values[f"{prefix}_{key}"] = value
+    return values
+
+def snapshot():
+    """Per-stage latency summaries, counters and gauges as plain dicts"""
+    with _lock:
+        stages = {}
+        for name, histogram in _histograms.items():
+            recent = np.asarray(histogram.recent) * 1000.0
+            stages[name] = {
+                "count": histogram.count,
+                "mean_ms": round(1000.0 * histogram.total / histogram.count, 2),
+                "p50_ms": round(float(np.percentile(recent, 50)), 2),
+                "p95_ms": round(float(np.percentile(recent, 95)), 2),
+            }
+        counters = dict(_counters)
+    return {"stages": stages, "counters": counters, "gauges": _gauge_values()}
+
+def prometheus_text():
+    """All metrics in the Prometheus text exposition format"""
+    lines = [
+        f"# HELP {_PREFIX}_stage_seconds Duration of pipeline stages",
+        f"# TYPE {_PREFIX}_stage_seconds histogram",
+    ]
+    with _lock:
+        for name, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + (float("inf"),), histogram.buckets):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{_PREFIX}_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{_PREFIX}_stage_seconds_sum{{stage="{name}"}} {histogram.total}')
+            lines.append(f'{_PREFIX}_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+        counters = sorted(_counters.items())
+    lines.append(f"# HELP {_PREFIX}_events_total Pipeline event counters")
+    lines.append(f"# TYPE {_PREFIX}_events_total counter")
+    for name, value in counters:
+        lines.append(f'{_PREFIX}_events_total{{event="{name}"}} {value}')
+    for name, value in sorted(_gauge_values().items()):
+        lines.append(f"# TYPE {_PREFIX}_{name} gauge")
+        lines.append(f"{_PREFIX}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=TELEMETRY_PORT, host="0.0.0.0"):
+    """Serve /metrics for Prometheus on a background thread, once per process"""
+    global _server
+    if not ENABLED or not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="telemetry-metrics",
+                             daemon=True).start()
+    return _server
+
+def reset():
+    """Forget all recorded spans and counters"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
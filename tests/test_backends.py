@@ -0,0 +1,32 @@
+from PIL import Image
+
+import backends
+
+class _Member(backends.Backend):
+    """Network-style member that records the uploads it was sent"""
+
+    def __init__(self):
+        self.payloads = []
+
+    def predict_payload(self, payload, scale, imgsz, conf, iou, retina_masks=False):
+        self.payloads.append(payload)
+        return {"images": [{"shape": [10, 10], "results": []}]}
+
+def test_ensemble_batch_encodes_each_image_once(monkeypatch):
+    encoded = []
+    prepare_upload = backends.prepare_upload
+
+    def counting_prepare_upload(img, imgsz):
+        encoded.append(img)
+        return prepare_upload(img, imgsz)
+
+    monkeypatch.setattr(backends, "prepare_upload", counting_prepare_upload)
+    members = [_Member(), _Member()]
+    ensemble = backends.EnsembleBackend(["a", "b"], members)
+    images = [Image.new("RGB", (64, 48), (i * 40, 0, 0)) for i in range(3)]
+    results = ensemble.predict_batch(images, 640, 0.25, 0.45)
+
+    assert len(results) == 3
+    assert len(encoded) == 3
+    # Both members got the very same upload buffers
+    assert sorted(map(id, members[0].payloads)) == sorted(map(id, members[1].payloads))
@@ -0,0 +1,71 @@
+import numpy as np
+from PIL import Image
+
+import backends
+import fusion
+import tiling
+
+def _row(*xs, size=10):
+    return np.array([[x, 0, x + size, size] for x in xs], dtype=np.float64)
+
+def test_cluster_keeps_box_whose_suppressor_was_merged_away():
+    # 2.5 suppresses 5 under Fast NMS, but 2.5 itself joins 0, and 0 barely overlaps 5
+    boxes = _row(0, 2.5, 5)
+    keep, owner = fusion.cluster(boxes, [0.9, 0.8, 0.7], threshold=0.55)
+    assert sorted(keep.tolist()) == [0, 2]
+    assert owner.tolist() == [0, 0, 2]
+
+def test_cluster_matches_greedy_nms_on_a_chain():
+    boxes = _row(0, 2.5, 5, 7.5, 10)
+    keep, owner = fusion.cluster(boxes, [0.9, 0.8, 0.7, 0.6, 0.5], threshold=0.55)
+    assert keep.tolist() == [0, 2, 4]
+    assert owner.tolist() == [0, 0, 2, 2, 4]
+
+def test_cluster_respects_classes():
+    boxes = _row(0, 1)
+    keep, owner = fusion.cluster(boxes, [0.9, 0.8], classes=[0, 1], threshold=0.5)
+    assert keep.tolist() == [0, 1]
+    assert owner.tolist() == [0, 1]
+
+def test_merge_keeps_plant_whose_only_suppressor_was_merged():
+    detections = [{"name": "Healthy", "class": 0, "confidence": c} for c in (0.9, 0.8, 0.7)]
+    boxes = _row(0, 2.5, 5)
+    merged = tiling.merge(detections, boxes, np.zeros(3, dtype=bool), threshold=0.55)
+    assert len(merged) == 2
+    assert [d["confidence"] for d in merged] == [0.9, 0.7]
+
+def _response(*detections):
+    return {"images": [{"shape": [100, 100], "results": [
+        {"name": "Healthy", "class": 0, "confidence": confidence,
+         "box": {"x1": x, "y1": 0, "x2": x + 10, "y2": 10}}
+        for x, confidence in detections]}]}
+
+def test_fuse_results_adding_a_model_keeps_every_plant():
+    first = _response((0, 0.9), (5, 0.7))
+    second = _response((2.5, 0.8))
+    assert len(backends.fuse_results([first], threshold=0.55)["images"][0]["results"]) == 2
+    fused = backends.fuse_results([first, second], threshold=0.55)["images"][0]["results"]
+    assert [d["confidence"] for d in fused] == [0.9, 0.7]
+
+class _ModelMember(backends.Backend):
+    """Network-style member answering every view with one fixed detection"""
+
+    def __init__(self, name, box):
+        self.name_ = name
+        self.box = box
+
+    def predict_payload(self, payload, scale, imgsz, conf, iou, retina_masks=False):
+        x1, y1, x2, y2 = self.box
+        return {"images": [{"shape": [imgsz, imgsz], "results": [
+            {"name": self.name_, "class": 0, "confidence": 0.9,
+             "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}}]}]}
+
+def test_tiled_ensemble_keeps_classes_with_colliding_ids():
+    # Both models call their first class 0; a weed sits inside a lettuce
+    members = [_ModelMember("normal_lettuce", (10, 10, 200, 200)),
+               _ModelMember("weed", (50, 50, 120, 120))]
+    ensemble = backends.EnsembleBackend(["lettuce", "weed"], members)
+    image = Image.new("RGB", (1400, 700))
+    results = tiling.predict_tiled(image, ensemble, 640, 0.25, 0.45)["images"][0]["results"]
+    names = {d["name"] for d in results}
+    assert names == {"normal_lettuce", "weed"}
@@ -0,0 +1,47 @@
+import gc
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import backends
+import ingest
+import process
+import stub_api
+import validation
+
+@pytest.fixture(scope="module")
+def stub_backend():
+    server, url = stub_api.start(detections=20)
+    yield backends.RemoteBackend(model="stub", key="stub", url=url)
+    server.shutdown()
+
+def _field_jpeg(width=4000, height=3000):
+    """A full-resolution camera-sized JPEG with enough texture to be realistic"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], -1)
+    pixels = (pixels + rng.integers(0, 32, pixels.shape)).clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+def _analyse(image_bytes, backend, segment):
+    image = ingest.IngestedImage(image_bytes, process.working_max_side()).image
+    results = process.request_results(image, image_bytes, process.CONF_FLOOR, retina_masks=True,
+                                      backend=backend, use_cache=False)
+    draw = process.draw_segments if segment else process.draw_boxes
+    annotated, _ = draw(image, results, 0.25)
+    return process.display_jpeg(annotated)
+
+@pytest.mark.parametrize("segment", [False, True])
+def test_large_upload_stays_within_rss_budget(stub_backend, segment):
+    image_bytes = _field_jpeg()
+    # Load fonts, codecs and connection pools before measuring
+    _analyse(image_bytes, stub_backend, segment)
+    gc.collect()
+    with validation.RSSSampler(interval=0.002) as rss:
+        before = rss.peak
+        _analyse(image_bytes, stub_backend, segment)
+    assert (rss.peak - before) / 2**20 < validation.RSS_BUDGET_MB
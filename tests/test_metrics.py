@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+import pytest
+
+import metrics
+
+def _ap(tp, confidences, n_gt):
+    tp = np.asarray(tp, dtype=bool)[:, None]
+    result = metrics.ap_per_class(tp, np.asarray(confidences, dtype=np.float64),
+                                  np.zeros(len(tp), dtype=int), np.zeros(n_gt, dtype=int), 1)
+    return result["ap"][0, 0]
+
+def _reference_ap(tp, n_gt):
+    """Ultralytics' compute_ap for predictions already sorted by confidence"""
+    tp = np.asarray(tp, dtype=float)
+    recall = np.cumsum(tp) / n_gt
+    precision = np.cumsum(tp) / np.arange(1, len(tp) + 1)
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return np.trapezoid(np.interp(x, mrec, mpre), x)
+
+def test_ap_is_zero_without_true_positives():
+    assert _ap([False, False], [0.9, 0.8], 2) == 0.0
+
+def test_ap_at_half_recall():
+    # One of two labels found with perfect precision
+    assert _ap([True], [0.9], 2) == pytest.approx(0.75)
+
+def test_ap_matches_ultralytics_on_partial_recall():
+    rng = np.random.default_rng(0)
+    tp = rng.random(40) < 0.4
+    confidences = np.sort(rng.random(40))[::-1]
+    assert _ap(tp, confidences, 30) == pytest.approx(_reference_ap(tp, 30))
+
+def test_evaluate_ignores_classes_from_another_model(tmp_path):
+    (tmp_path / "field.txt").write_text("0 0.5 0.5 0.2 0.2\n")
+    record = {"path": "field.jpg", "width": 100, "height": 100, "results": [
+        {"name": "disease_lettuce", "class": 0, "confidence": 0.9,
+         "box": {"x1": 40, "y1": 40, "x2": 60, "y2": 60}},
+        {"name": "other_model_class", "class": 7, "confidence": 0.8,
+         "box": {"x1": 0, "y1": 0, "x2": 10, "y2": 10}},
+    ]}
+    summary = metrics.evaluate([json.dumps(record)], str(tmp_path),
+                               ["disease_lettuce", "normal_lettuce", "weed"], workers=1)
+    assert summary["unknown_detections"] == 1
+    assert summary["classes"]["disease_lettuce"]["box"]["mAP50"] == pytest.approx(0.995)
@@ -0,0 +1,55 @@
+import copy
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import masks
+import render
+
+def _sequential(img, results, confidence_threshold):
+    """The original renderer: one translucent polygon fill per detection"""
+    predicted_image = img.copy()
+    draw = ImageDraw.Draw(predicted_image, "RGBA")
+    width, height = predicted_image.size
+    for detection in results["images"][0]["results"]:
+        if detection["confidence"] >= confidence_threshold:
+            segments = detection["segments"]
+            points = [(min(max(x, 0), width), min(max(y, 0), height))
+                      for x, y in zip(segments["x"], segments["y"])]
+            draw.polygon(points, fill=render.class_rgb(detection["name"]) + (render.MASK_ALPHA,))
+    return predicted_image
+
+def _scene(seed, width=480, height=360, count=30):
+    """Random, heavily overlapping plant outlines, some running off the image"""
+    rng = np.random.default_rng(seed)
+    img = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    names = ["normal_lettuce", "disease_lettuce", "weed"]
+    detections = []
+    for k in range(count):
+        cx, cy = rng.uniform(-40, width + 40), rng.uniform(-40, height + 40)
+        radius = rng.uniform(10, 150) * rng.uniform(0.5, 1, 12)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 12))
+        detections.append({
+            "name": names[k % 3], "class": k % 3, "confidence": float(rng.uniform()),
+            "box": {"x1": cx - radius.max(), "y1": cy - radius.max(),
+                    "x2": cx + radius.max(), "y2": cy + radius.max()},
+            "segments": {"x": np.round(cx + radius * np.cos(angles), 1).tolist(),
+                         "y": np.round(cy + radius * np.sin(angles), 1).tolist()},
+        })
+    return img, {"images": [{"shape": [height, width], "results": detections}]}
+
+@pytest.mark.parametrize("seed", range(5))
+def test_overlapping_masks_blend_like_the_sequential_renderer(seed):
+    img, results = _scene(seed)
+    expected = np.array(_sequential(img, results, 0.25))
+    rendered, _ = render.render_segments(img, results, 0.25)
+    assert np.array_equal(np.array(rendered), expected)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_run_length_masks_render_like_their_polygons(seed):
+    img, results = _scene(seed)
+    compact = masks.compact_results(copy.deepcopy(results), img.size, mask_format="rle")
+    expected = np.array(_sequential(img, results, 0.25))
+    rendered, _ = render.render_segments(img, compact, 0.25)
+    assert np.array_equal(np.array(rendered), expected)
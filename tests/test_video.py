@@ -0,0 +1,28 @@
+import numpy as np
+
+import video
+
+def _box(x, y, size=100):
+    return [x, y, x + size, y + size]
+
+def _run(tracker, keyframes, interval=10):
+    for k, boxes in enumerate(keyframes):
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        tracker.update(k * interval, boxes, ["normal_lettuce"] * len(boxes), [0.9] * len(boxes))
+    return tracker
+
+def test_adjacent_static_plants_stay_two_tracks():
+    left, right = _box(0, 0), _box(100, 0)
+    # The right plant is first detected on a keyframe that misses the left one
+    keyframes = [[left]] * 3 + [[right]] + [[left, right]] * 5
+    tracker = _run(video.IoUTracker(), keyframes)
+    tracks = tracker.tracks()
+    assert len(tracker.finished) + len(tracker.ids) == 2
+    assert sorted(track["hits"] for track in tracks) == [6, 8]
+
+def test_moving_plant_stays_one_track():
+    # Moves too far per keyframe for its first two boxes to overlap enough
+    keyframes = [[_box(40 * k, 25 * k)] for k in range(12)]
+    tracker = _run(video.IoUTracker(), keyframes)
+    assert len(tracker.finished) + len(tracker.ids) == 1
+    assert tracker.tracks()[0]["hits"] == 12
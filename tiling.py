@@ -0,0 +1,165 @@
+"""Tiled inference for full-resolution field images.
+
+A 4000x3000 overhead shot squeezed into one 640 px model input loses the
+seedlings and small weeds. Here the original is cut into overlapping
+model-sized tiles, all tiles (plus one downscaled view of the whole image,
+for plants larger than a tile) go to the backend in a single batch, and the
+per-tile detections are mapped back to global coordinates and merged with
+one vectorized clustering step instead of a loop over tile pairs.
+"""
+import math
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+import fusion
+
+load_dotenv()
+
+# Fraction of a tile shared with each neighbour
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+# Upper bound on tiles per image; larger images get larger tiles instead,
+# which keeps the number of model calls (and the latency) bounded
+TILE_MAX = int(os.getenv("TILE_MAX", "24"))
+# Intersection over the smaller box above which detections are merged
+TILE_MERGE_THRESHOLD = float(os.getenv("TILE_MERGE_THRESHOLD", "0.6"))
+# Concurrent tile requests for network backends
+TILE_WORKERS = int(os.getenv("TILE_WORKERS", "8"))
+
+# Detections this close (px) to a tile edge inside the image are probably cut off
+_EDGE_MARGIN = 2
+# Ranking penalty for cut-off detections, so the complete view of a plant wins
+_EDGE_PENALTY = 0.5
+
+def cache_params():
+    """Tiling settings that change the output and must be part of the cache key"""
+    return {
+        "tile_overlap": TILE_OVERLAP,
+        "tile_max": TILE_MAX,
+        "tile_merge_threshold": TILE_MERGE_THRESHOLD,
+    }
+
+def _positions(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    stride = tile_size * (1.0 - overlap)
+    count = math.ceil((length - tile_size) / stride) + 1
+    # Spread evenly so the last tile ends exactly on the image border
+    return np.linspace(0, length - tile_size, count).round().astype(int).tolist()
+
+def tile_grid(width, height, tile_size, overlap=TILE_OVERLAP, max_tiles=TILE_MAX):
+    """xyxy windows of overlapping tiles covering a width x height image"""
+    tile_size = max(1, int(tile_size))
+    while True:
+        xs = _positions(width, tile_size, overlap)
+        ys = _positions(height, tile_size, overlap)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile_size = int(tile_size * 1.25) + 1
+    return [(x, y, min(width, x + tile_size), min(height, y + tile_size))
+            for y in ys for x in xs]
+
+def _gather(results_per_view, offsets, windows, width, height):
+    """Flatten detections from all views into global-coordinate arrays"""
+    detections = []
+    boxes = []
+    edge = []
+    for results, (ox, oy), window in zip(results_per_view, offsets, windows):
+        for detection in results["images"][0].get("results", []):
+            box = detection.get("box")
+            if not box:
+                continue
+            x1, y1 = float(box["x1"]) + ox, float(box["y1"]) + oy
+            x2, y2 = float(box["x2"]) + ox, float(box["y2"]) + oy
+            detection = dict(detection, box={"x1": x1, "y1": y1, "x2": x2, "y2": y2})
+            segments = detection.get("segments")
+            if segments and segments.get("x"):
+                detection["segments"] = {
+                    "x": (np.asarray(segments["x"], dtype=np.float64) + ox).tolist(),
+                    "y": (np.asarray(segments["y"], dtype=np.float64) + oy).tolist(),
+                }
+            detections.append(detection)
+            boxes.append((x1, y1, x2, y2))
+            edge.append(window)
+
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    edge = np.asarray(edge, dtype=np.float64).reshape(-1, 4)
+    # A box touching its tile's edge is cut off unless that edge is the image border
+    cut = ((boxes[:, 0] <= edge[:, 0] + _EDGE_MARGIN) & (edge[:, 0] > 0)) \
+        | ((boxes[:, 1] <= edge[:, 1] + _EDGE_MARGIN) & (edge[:, 1] > 0)) \
+        | ((boxes[:, 2] >= edge[:, 2] - _EDGE_MARGIN) & (edge[:, 2] < width)) \
+        | ((boxes[:, 3] >= edge[:, 3] - _EDGE_MARGIN) & (edge[:, 3] < height))
+    return detections, boxes, cut
+
+def merge(detections, boxes, cut, threshold=TILE_MERGE_THRESHOLD):
+    """Merge duplicate detections of one plant seen by several tiles.
+
+    Clusters are formed by class-aware matrix NMS on intersection over the
+    smaller box, so a cut-off half still joins the whole plant. Each merged
+    detection keeps the best confidence, the enclosing box of its cluster
+    and the polygon of its largest member, i.e. the most complete view.
+    """
+    if not detections:
+        return []
+    confidences = np.array([float(d.get("confidence", 0.0)) for d in detections])
+    # Class ids are per model and collide in an ensemble; names do not
+    classes = np.array([d.get("name", d.get("class")) for d in detections], dtype=object)
+    _, class_ids = np.unique(classes.astype(str), return_inverse=True)
+    rank = np.where(cut, confidences * _EDGE_PENALTY, confidences)
+
+    keep, owner = fusion.cluster(boxes, rank, class_ids, threshold, metric="ios")
+    fused = fusion.fuse_boxes(boxes, rank, owner, keep, mode="union")
+
+    slot = np.full(len(boxes), -1)
+    slot[keep] = np.arange(len(keep))
+    member = slot[owner]
+    valid = member >= 0
+    best_confidence = np.zeros(len(keep))
+    np.maximum.at(best_confidence, member[valid], confidences[valid])
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    largest_area = np.full(len(keep), -1.0)
+    np.maximum.at(largest_area, member[valid], area[valid])
+    largest = keep.copy()
+    candidates = np.flatnonzero(valid & (area >= largest_area[np.maximum(member, 0)]))
+    largest[member[candidates]] = candidates
+
+    merged = []
+    for k, (index, box) in enumerate(zip(keep, fused)):
+        detection = dict(detections[index])
+        detection["confidence"] = float(best_confidence[k])
+        detection["box"] = dict(zip(("x1", "y1", "x2", "y2"), box.tolist()))
+        segments = detections[largest[k]].get("segments")
+        if segments:
+            detection["segments"] = segments
+        merged.append(detection)
+    return merged
+
+def predict_tiled(img, backend, imgsz, conf, iou, retina_masks=False, overlap=TILE_OVERLAP,
+                  max_tiles=TILE_MAX, threshold=TILE_MERGE_THRESHOLD):
+    """Predict on overlapping tiles of img and merge them into one result.
+
+    Coordinates in the returned schema are pixels of img. Images no larger
+    than a tile take the ordinary single-request path.
+    """
+    width, height = img.size
+    windows = tile_grid(width, height, imgsz, overlap, max_tiles)
+    if len(windows) == 1:
+        return backend.predict(img, imgsz, conf, iou, retina_masks)
+
+    # The whole image goes along too, for plants larger than a tile; every
+    # backend reports coordinates in pixels of the view it was given
+    windows = windows + [(0, 0, width, height)]
+    views = [img.crop(window) for window in windows[:-1]] + [img]
+    offsets = [window[:2] for window in windows]
+    results_per_view = backend.predict_batch(views, imgsz, conf, iou, retina_masks,
+                                             max_workers=TILE_WORKERS)
+
+    detections, boxes, cut = _gather(results_per_view, offsets, windows, width, height)
+    return {
+        "images": [{
+            "results": merge(detections, boxes, cut, threshold),
+            "shape": [height, width],
+            "tiles": len(windows) - 1,
+        }]
+    }
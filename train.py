@@ -1,15 +1,131 @@
+"""Train or fine-tune the lettuce health model.
+
+    python train.py                                  # GPU if available, else CPU
+    python train.py --device cpu --prepare-only      # build the image caches only
+    python train.py --device cpu --model PHMv25/weights/best.pt --epochs 20 --name PHMv3
+
+On CPU the images of every split are first decoded and letterboxed once
+into a memory-mapped cache (see dataset_cache.py) that training reads
+from, instead of decoding every JPEG again in every epoch.
+"""
+import argparse
+import os
+
+import cv2
+import torch
 from ultralytics import YOLO
+from ultralytics.data import YOLODataset
+from ultralytics.data.utils import check_det_dataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.models.yolo.segment import SegmentationTrainer
+from ultralytics.utils import colorstr
+from ultralytics.utils.torch_utils import de_parallel
 
-if __name__ == '__main__':
-    # Load the YOLOv8 small model
-    model = YOLO('yolov8s.pt')
+import dataset_cache
+
+DATA = 'C:\\Users\\Yuri\\Projects\\plant_identification\\datasets\\PHM-v2-2\\data.yaml'
+
+class MemmapYOLODataset(YOLODataset):
+    """YOLODataset whose load_image reads from a prepared DatasetCache"""
+
+    def __init__(self, *args, memmap_cache=None, **kwargs):
+        self.memmap_cache = memmap_cache
+        super().__init__(*args, **kwargs)
+        self.memmap_rows = [memmap_cache.rows.get(os.path.realpath(f), -1) for f in self.im_files]
+
+    def load_image(self, i, rect_mode=True):
+        row = self.memmap_rows[i]
+        if row < 0:
+            return super().load_image(i, rect_mode)
+        im, hw0, hw = self.memmap_cache.image(row)
+        if not rect_mode and hw != (self.imgsz, self.imgsz):
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+            hw = im.shape[:2]
+        if self.augment:
+            # Mosaic picks its partner images from this buffer
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                self.buffer.pop(0)
+        return im, hw0, hw
+
+class MemmapDatasetMixin:
+    """Builds datasets backed by the memory-mapped image cache"""
 
-    # Train the model
-    model.train(data='C:\\Users\\Yuri\\Projects\\plant_identification\\datasets\\PHM-v2-2\\data.yaml', 
-                epochs=100,
-                imgsz=640,
+    def build_dataset(self, img_path, mode="train", batch=None):
+        stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+        cfg = self.args
+        directory = dataset_cache.prepare(img_path, cfg.imgsz, cfg.workers or None)
+        cache = dataset_cache.DatasetCache(directory)
+        return MemmapYOLODataset(
+            memmap_cache=cache,
+            img_path=img_path,
+            imgsz=cfg.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=cfg,
+            rect=cfg.rect or mode == "val",
+            cache=None,
+            single_cls=cfg.single_cls or False,
+            stride=stride,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            task=cfg.task,
+            classes=cfg.classes,
+            data=self.data,
+            fraction=cfg.fraction if mode == "train" else 1.0,
+        )
+
+class MemmapDetectionTrainer(MemmapDatasetMixin, DetectionTrainer):
+    pass
+
+class MemmapSegmentationTrainer(MemmapDatasetMixin, SegmentationTrainer):
+    pass
+
+MEMMAP_TRAINERS = {
+    "detect": MemmapDetectionTrainer,
+    "segment": MemmapSegmentationTrainer,
+}
+
+def prepare_caches(data, imgsz, workers=None):
+    """Decode every split listed in data.yaml into its memory-mapped cache"""
+    dataset = check_det_dataset(data)
+    for split in ("train", "val", "test"):
+        if dataset.get(split):
+            directory = dataset_cache.prepare(dataset[split], imgsz, workers)
+            print(f"{split}: {directory}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the lettuce health model")
+    parser.add_argument("--data", default=DATA)
+    parser.add_argument("--model", default="yolov8s.pt", help="starting weights")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--name", default="PHMv2")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--memmap", action=argparse.BooleanOptionalAction, default=None,
+                        help="read images from the memory-mapped cache (default: on for CPU)")
+    parser.add_argument("--prepare-only", action="store_true",
+                        help="build the image caches and exit")
+    args = parser.parse_args()
+
+    if args.prepare_only:
+        prepare_caches(args.data, args.imgsz, args.workers)
+        return
+
+    memmap = args.memmap if args.memmap is not None else args.device == "cpu"
+    model = YOLO(args.model)
+    model.train(data=args.data,
+                epochs=args.epochs,
+                imgsz=args.imgsz,
                 plots=True,
-                name="PHMv2",
-                batch=8,
-                device='cuda',
-            )
\ No newline at end of file
+                name=args.name,
+                batch=args.batch,
+                device=args.device,
+                workers=args.workers,
+                trainer=MEMMAP_TRAINERS[model.task] if memmap else None,
+            )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""End-to-end latency and throughput benchmark.
+
+Replays a directory of images through the same pipeline the app runs for
+an upload (decode, process.request_results, rendering, display encoding)
+and writes the results as JSON:
+
+    python validation.py --target stub --latency 0.15 --concurrency 1 4 8 --json bench/stub.json
+    python validation.py --target local --concurrency 1 2 --json bench/local.json
+    python validation.py --target stub --compare bench/stub.json   # exit 1 on regression
+    python validation.py --target stub --mode segment --rss-budget 100
+
+"stub" starts stub_api.py in a subprocess with the given injected latency,
+"remote" uses API_URL from .env and "local" the in-process YOLO model. The
+prediction cache is bypassed so every image pays for inference. Every run
+also measures how much one analysis adds to the peak RSS, images one at a
+time, and fails when that exceeds --rss-budget (RSS_BUDGET_MB).
+"""
+import argparse
+import concurrent.futures
+import datetime
+import gc
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import api_client
+import backends
+import ingest
+import predict
+import process
+
+# "inference" covers everything process.request_results does, upload encoding included
+STAGES = ("read", "decode", "inference", "render", "display", "total")
+
+# A run is a regression when it is this much worse than the baseline...
+REGRESSION_TOLERANCE = 0.15
+# ...and, for stage latencies, also worse by at least this many ms, so
+# sub-millisecond stages do not flag scheduler noise
+REGRESSION_MIN_MS = 5.0
+
+# Most one analysis may add to the peak RSS, in MB (see analysis_rss)
+RSS_BUDGET_MB = float(os.getenv("RSS_BUDGET_MB", "64"))
+
+class RSSSampler:
+    """Tracks the peak resident set size of this process while running"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+def run_image(path, backend, mode, tiled=False):
+    """One image through the app's pipeline; returns per-stage seconds.
+
+    Inference goes through process.request_results with the cache
+    bypassed, so it includes the upload encoding, tiling, mask compaction
+    and the Detections the app renders from.
+    """
+    timings = {}
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    mark = time.perf_counter()
+    timings["read"] = mark - start
+
+    image = ingest.IngestedImage(image_bytes, process.working_max_side()).image
+    timings["decode"] = time.perf_counter() - mark
+    mark = time.perf_counter()
+
+    results = process.request_results(image, image_bytes, process.CONF_FLOOR, retina_masks=True,
+                                      tiled=tiled, backend=backend, use_cache=False)
+    timings["inference"] = time.perf_counter() - mark
+    mark = time.perf_counter()
+
+    if mode == "segment":
+        annotated, _ = process.draw_segments(image, results, 0.25)
+    else:
+        annotated, _ = process.draw_boxes(image, results, 0.25)
+    timings["render"] = time.perf_counter() - mark
+    mark = time.perf_counter()
+
+    process.display_jpeg(annotated)
+    done = time.perf_counter()
+    timings["display"] = done - mark
+    timings["total"] = done - start
+    return timings
+
+def analysis_rss(paths, backend, mode, tiled=False):
+    """Largest RSS growth (MB) during one analysis, images run one at a time.
+
+    Each image is measured from the RSS just before it, so this is what a
+    single upload costs on top of what the process already holds; the
+    first image is run once beforehand to load libraries and fonts.
+    """
+    run_image(paths[0], backend, mode, tiled)
+    worst = 0.0
+    for path in paths:
+        gc.collect()
+        with RSSSampler(interval=0.002) as rss:
+            before = rss.peak
+            run_image(path, backend, mode, tiled)
+        worst = max(worst, (rss.peak - before) / 2**20)
+    return round(worst, 1)
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000.0
+    if len(values) == 0:
+        return {}
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+    }
+
+def run_level(paths, backend, mode, concurrency, count, tiled=False):
+    """Replay count images (cycling through paths) with concurrency workers"""
+    work = list(itertools.islice(itertools.cycle(paths), count))
+    timings = {stage: [] for stage in STAGES}
+    errors = 0
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            futures = [pool.submit(run_image, path, backend, mode, tiled) for path in work]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except backends.BackendError:
+                    errors += 1
+                    continue
+                for stage, seconds in result.items():
+                    timings[stage].append(seconds)
+        elapsed = time.perf_counter() - start
+    completed = len(work) - errors
+    return {
+        "concurrency": concurrency,
+        "images": completed,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(completed / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "stages": {stage: _percentiles(values) for stage, values in timings.items()},
+    }
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_stub(latency, detections):
+    """Run stub_api.py in its own process so it does not share our GIL or RSS"""
+    port = _free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_api.py"),
+         "--port", str(port), "--latency", str(latency), "--detections", str(detections)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return stub, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    stub.kill()
+    raise RuntimeError("stub_api.py did not start")
+
+def _lifetime_peak_rss():
+    """Peak RSS in bytes since the process started"""
+    if resource is None:
+        return psutil.Process().memory_info().peak_wset
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(paths, backend, mode="box", levels=(1, 4, 8), count=None, warmup=2, tiled=False):
+    """Run every concurrency level and return the report dict"""
+    count = count or len(paths)
+    api_client.POOL_SIZE = max(api_client.POOL_SIZE, max(levels))
+    for path in paths[:warmup]:
+        run_image(path, backend, mode, tiled)
+    api_client.reset_stats()
+
+    runs = [run_level(paths, backend, mode, level, count, tiled) for level in levels]
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": backend.name,
+            "mode": mode,
+            "tiled": tiled,
+            "images": count,
+            "distinct_images": len(paths),
+        },
+        "runs": runs,
+        "connections": api_client.stats(),
+        "peak_rss_mb": round(_lifetime_peak_rss() / 2**20, 1),
+    }
+
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Regressions of report against a baseline report, as readable strings"""
+    problems = []
+    previous = {run["concurrency"]: run for run in baseline.get("runs", [])}
+    for run in report["runs"]:
+        old = previous.get(run["concurrency"])
+        if old is None:
+            continue
+        label = f"concurrency {run['concurrency']}"
+        if run["images_per_sec"] < old["images_per_sec"] * (1 - tolerance):
+            problems.append(f"{label}: {run['images_per_sec']} img/s "
+                            f"vs {old['images_per_sec']} img/s")
+        for stage, values in run["stages"].items():
+            before = old["stages"].get(stage, {}).get("p95_ms")
+            after = values.get("p95_ms", 0)
+            if before and after > before * (1 + tolerance) and after - before >= REGRESSION_MIN_MS:
+                problems.append(f"{label}: {stage} p95 {after} ms vs {before} ms")
+        if run["peak_rss_mb"] > old["peak_rss_mb"] * (1 + tolerance):
+            problems.append(f"{label}: peak RSS {run['peak_rss_mb']} MB "
+                            f"vs {old['peak_rss_mb']} MB")
+    return problems
+
+def format_report(report):
+    lines = [f"{'conc':>4} {'img/s':>8} {'errors':>6} {'rss MB':>8}  "
+             + " ".join(f"{stage + ' p50/p95/p99':>26}" for stage in STAGES)]
+    for run in report["runs"]:
+        cells = []
+        for stage in STAGES:
+            values = run["stages"].get(stage) or {}
+            cells.append(f"{values.get('p50_ms', 0):>8.1f}/{values.get('p95_ms', 0):>7.1f}"
+                         f"/{values.get('p99_ms', 0):>7.1f}".rjust(26))
+        lines.append(f"{run['concurrency']:>4} {run['images_per_sec']:>8.2f} {run['errors']:>6} "
+                     f"{run['peak_rss_mb']:>8.1f}  " + " ".join(cells))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference pipeline")
+    parser.add_argument("inputs", nargs="*", default=["samples"],
+                        help="image directories, files or glob patterns (default: samples)")
+    parser.add_argument("--target", choices=("stub", "remote", "local"), default="stub")
+    parser.add_argument("--latency", type=float, default=0.15,
+                        help="injected stub latency in seconds")
+    parser.add_argument("--detections", type=int, default=20, help="stub detections per image")
+    parser.add_argument("--models", type=int, default=1,
+                        help="stub models queried together through the ensemble backend")
+    parser.add_argument("--mode", choices=("box", "segment"), default="box")
+    parser.add_argument("--tiled", action="store_true", help="analyse full resolution in tiles")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--images", type=int, help="images per level (default: all inputs once)")
+    parser.add_argument("--json", help="write the report here")
+    parser.add_argument("--compare", help="baseline report; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--rss-budget", type=float, default=RSS_BUDGET_MB,
+                        help="MB one analysis may add to peak RSS; exit 1 when exceeded")
+    args = parser.parse_args()
+
+    paths = predict.find_images(args.inputs)
+    if not paths:
+        parser.error("no images found")
+
+    stub = None
+    try:
+        if args.target == "stub":
+            stub, url = start_stub(args.latency, args.detections)
+            names = [f"stub{i}" for i in range(args.models)] if args.models > 1 else ["stub"]
+            members = [backends.RemoteBackend(model=name, key="stub", url=url) for name in names]
+            backend = members[0] if len(members) == 1 else backends.EnsembleBackend(names, members)
+        else:
+            backend = backends.get_backend(args.target)
+        report = benchmark(paths, backend, args.mode, args.concurrency, args.images,
+                           tiled=args.tiled)
+        report["analysis_rss_mb"] = analysis_rss(paths, backend, args.mode, args.tiled)
+    except backends.BackendError as e:
+        print(f"Benchmark failed: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+    report["meta"]["target"] = args.target
+    if args.target == "stub":
+        report["meta"]["injected_latency"] = args.latency
+        report["meta"]["models"] = args.models
+
+    print(format_report(report))
+    print(f"Peak RSS growth per analysis: {report['analysis_rss_mb']} MB "
+          f"(budget {args.rss_budget:g} MB)")
+    if args.json:
+        os.makedirs(os.path.dirname(args.json) or ".", exist_ok=True)
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    problems = []
+    if report["analysis_rss_mb"] > args.rss_budget:
+        problems.append(f"one analysis grew RSS by {report['analysis_rss_mb']} MB, "
+                        f"over the {args.rss_budget:g} MB budget")
+    if args.compare:
+        with open(args.compare) as f:
+            problems += compare(report, json.load(f), args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Video analysis with keyframe inference and lightweight tracking.
+
+Full inference only runs on every keyframe_interval-th frame. Detections are
+associated to tracks by IoU (Hungarian matching on the predicted boxes) and
+each track's box is carried across the frames in between by an alpha-beta
+filter, the steady-state form of a constant-velocity Kalman filter. Every
+plant ends up as one track with a confidence-weighted majority health label,
+so it is counted once rather than once per frame.
+
+    python video.py row_walk.mp4 --interval 10 --output annotated.mp4
+"""
+import argparse
+import collections
+import json
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+from scipy.optimize import linear_sum_assignment
+
+import backends
+import process
+import render
+from detections import Detections
+from fusion import iou_matrix
+
+KEYFRAME_INTERVAL = int(os.getenv("VIDEO_KEYFRAME_INTERVAL", "10"))
+
+def _to_cxcywh(boxes):
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                     boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+
+def _to_xyxy(state):
+    cx, cy, w, h = state[:, 0], state[:, 1], state[:, 2], state[:, 3]
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+class IoUTracker:
+    """Multi-object tracker over keyframe detections.
+
+    Track state lives in arrays (centre/size and per-frame velocity) so
+    prediction for all tracks is a single vectorized step.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_distance=0.5, max_misses=2, min_hits=2,
+                 alpha=0.6, beta=0.2):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.alpha = alpha
+        self.beta = beta
+        self.state = np.zeros((0, 4))
+        self.velocity = np.zeros((0, 4))
+        self.ids = []
+        self.hits = []
+        self.misses = []
+        self.last_update = []
+        self.votes = []
+        self.frames = []
+        self.finished = []
+        self._next_id = 1
+
+    def boxes(self, frame_index):
+        """Predicted xyxy boxes of live tracks at frame_index"""
+        if not self.ids:
+            return np.zeros((0, 4)), []
+        elapsed = frame_index - np.asarray(self.last_update, dtype=np.float64)
+        return _to_xyxy(self.state + self.velocity * elapsed[:, None]), list(self.ids)
+
+    def update(self, frame_index, boxes, names, confidences):
+        """Associate one keyframe's detections and update tracks"""
+        predicted, _ = self.boxes(frame_index)
+        measured = _to_cxcywh(boxes) if len(boxes) else np.zeros((0, 4))
+
+        matches = []
+        if len(predicted) and len(boxes):
+            overlap = iou_matrix(predicted, boxes)
+            rows, cols = linear_sum_assignment(-overlap)
+            keep = overlap[rows, cols] >= self.iou_threshold
+            matches = list(zip(rows[keep], cols[keep]))
+        matched_tracks = {t for t, _ in matches}
+        matched_dets = {d for _, d in matches}
+
+        # Second pass for tracks without a velocity estimate yet, whose
+        # prediction lags a moving plant: match on centre distance relative
+        # to the track's size. Tracks that have one are predicted where the
+        # plant should be, so a miss there is a miss, not its neighbour
+        tracks_left = [t for t in range(len(predicted))
+                       if t not in matched_tracks and self.hits[t] == 1]
+        dets_left = [d for d in range(len(boxes)) if d not in matched_dets]
+        if tracks_left and dets_left:
+            prior = _to_cxcywh(predicted[tracks_left])
+            offset = prior[:, None, :2] - measured[None, dets_left, :2]
+            scale = np.sqrt(np.maximum(prior[:, 2] * prior[:, 3], 1e-9))[:, None]
+            distance = np.hypot(offset[..., 0], offset[..., 1]) / scale
+            rows, cols = linear_sum_assignment(distance)
+            for r, c in zip(rows, cols):
+                if distance[r, c] <= self.max_distance:
+                    matches.append((tracks_left[r], dets_left[c]))
+                    matched_tracks.add(tracks_left[r])
+                    matched_dets.add(dets_left[c])
+
+        for t, d in matches:
+            elapsed = max(1, frame_index - self.last_update[t])
+            prior = self.state[t] + self.velocity[t] * elapsed
+            residual = measured[d] - prior
+            if self.hits[t] == 1:
+                # Two sightings give the first velocity estimate outright
+                self.state[t] = measured[d]
+                self.velocity[t] = residual / elapsed
+            else:
+                self.state[t] = prior + self.alpha * residual
+                self.velocity[t] = self.velocity[t] + self.beta * residual / elapsed
+            self.last_update[t] = frame_index
+            self.hits[t] += 1
+            self.misses[t] = 0
+            self.votes[t][names[d]] += confidences[d]
+            self.frames[t][1] = frame_index
+
+        for t in range(len(self.ids)):
+            if t not in matched_tracks:
+                self.misses[t] += 1
+
+        new = [d for d in range(len(boxes)) if d not in matched_dets]
+        if new:
+            self.state = np.vstack([self.state, measured[new]])
+            self.velocity = np.vstack([self.velocity, np.zeros((len(new), 4))])
+            for d in new:
+                self.ids.append(self._next_id)
+                self._next_id += 1
+                self.hits.append(1)
+                self.misses.append(0)
+                self.last_update.append(frame_index)
+                self.votes.append(collections.Counter({names[d]: confidences[d]}))
+                self.frames.append([frame_index, frame_index])
+
+        self._retire(lambda t: self.misses[t] > self.max_misses)
+
+    def _retire(self, condition):
+        drop = [t for t in range(len(self.ids)) if condition(t)]
+        if not drop:
+            return
+        for t in drop:
+            self.finished.append(self._summary(t))
+        dropped = set(drop)
+        keep = [t for t in range(len(self.ids)) if t not in dropped]
+        self.state = self.state[keep]
+        self.velocity = self.velocity[keep]
+        for name in ("ids", "hits", "misses", "last_update", "votes", "frames"):
+            values = getattr(self, name)
+            setattr(self, name, [values[t] for t in keep])
+
+    def _summary(self, t):
+        votes = self.votes[t]
+        return {
+            "id": self.ids[t],
+            "label": max(votes, key=votes.get),
+            "votes": {name: round(score, 4) for name, score in votes.items()},
+            "hits": self.hits[t],
+            "first_frame": self.frames[t][0],
+            "last_frame": self.frames[t][1],
+        }
+
+    def label(self, index):
+        votes = self.votes[index]
+        return max(votes, key=votes.get)
+
+    def tracks(self):
+        """Summaries of all confirmed tracks, finished or still live"""
+        live = [self._summary(t) for t in range(len(self.ids))]
+        return [track for track in self.finished + live if track["hits"] >= self.min_hits]
+
+def _detections(results, confidence_threshold):
+    kept = Detections.from_results(results).above(confidence_threshold)
+    return (kept.boxes.astype(np.float64), kept.class_names(),
+            kept.confidence.astype(np.float64).tolist())
+
+def _draw_tracks(frame, tracker, frame_index):
+    """Draw live track boxes, colored by their current majority label"""
+    boxes, ids = tracker.boxes(frame_index)
+    results = {"images": [{"results": [
+        {"name": tracker.label(t), "confidence": 1.0,
+         "box": dict(zip(("x1", "y1", "x2", "y2"), box.tolist()))}
+        for t, box in enumerate(boxes)
+    ]}]}
+    annotated, _ = render.render_boxes(Image.fromarray(frame), results, 0.0)
+    annotated = np.asarray(annotated).copy()
+    for track_id, box in zip(ids, boxes):
+        cv2.putText(annotated, str(track_id), (int(box[0]), max(12, int(box[1]) - 4)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+    return annotated
+
+def analyze_video(path, backend=None, keyframe_interval=KEYFRAME_INTERVAL,
+                  confidence_threshold=0.25, output_path=None, progress=None, tracker=None,
+                  keyframes=None):
+    """Track plants through a video and summarize them per track.
+
+    progress, if given, is called with (frame_index, frame_count).
+    keyframes, if given, maps frame indexes to their Detections at
+    CONF_FLOOR; missing keyframes are predicted and added, so passing the
+    same dict again re-runs only the tracking, e.g. at a new threshold.
+    Returns a dict with frame/inference counts, per-track labels and the
+    number of plants per health label.
+    """
+    backend = backend or backends.get_backend()
+    tracker = tracker or IoUTracker()
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video: {path}")
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    writer = None
+    frame_index = 0
+    inference_calls = 0
+
+    try:
+        while True:
+            ok, bgr = capture.read()
+            if not ok:
+                break
+            frame = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+            if frame_index % keyframe_interval == 0:
+                results = keyframes.get(frame_index) if keyframes is not None else None
+                if results is None:
+                    results = Detections.from_results(backend.predict(
+                        Image.fromarray(frame), process.IMGSZ, process.CONF_FLOOR, process.IOU))
+                    inference_calls += 1
+                    if keyframes is not None:
+                        keyframes[frame_index] = results
+                tracker.update(frame_index, *_detections(results, confidence_threshold))
+
+            if output_path:
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"),
+                                             fps, (width, height))
+                annotated = _draw_tracks(frame, tracker, frame_index)
+                writer.write(cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR))
+
+            frame_index += 1
+            if progress is not None:
+                progress(frame_index, frame_count)
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+
+    tracks = tracker.tracks()
+    counts = collections.Counter(track["label"] for track in tracks)
+    return {
+        "frames": frame_index,
+        "keyframe_interval": keyframe_interval,
+        "inference_calls": inference_calls,
+        "counts": dict(counts),
+        "tracks": tracks,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Count plants in a video by tracking them")
+    parser.add_argument("video")
+    parser.add_argument("--interval", type=int, default=KEYFRAME_INTERVAL,
+                        help="run inference on every Nth frame")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--output", help="write an annotated video here")
+    parser.add_argument("--backend", choices=sorted(backends.BACKENDS), default=backends.BACKEND)
+    args = parser.parse_args()
+
+    summary = analyze_video(args.video, backends.get_backend(args.backend), args.interval,
+                            args.conf, args.output)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()